@@ -13,6 +13,8 @@ from unified_planning.model.phgn.goal_network import PartialOrderGoalNetwork
 
 # PHGN Planner config
 from phgn_planner.config import UCTConfig
+from phgn_planner.heuristics import HEURISTICS
+from phgn_planner.stats import SUMMARY_FIELDS
 
 # Define the UCTConfig parameters that will be logged, in a specific order
 # This helps ensure consistent CSV column order.
@@ -26,9 +28,51 @@ UCT_CONFIG_PARAMS_TO_LOG = [
     "risk_factor",
     "goal_utility",
     "seed",
+    "n_workers",
+    "n_threads",
+    "virtual_loss",
+    "time_per_decision",
+    "time_budget",
+    "early_stop_interval",
+    "early_stop_confidence",
+    "max_nodes",
+    "eviction_policy",
+    "prune_tree",
+    "undo_goal_network",
+    "chance_nodes",
+    "expectation_backup",
+    "playout_depth",
+    "rollout_policy",
+    "rollout_heuristic",
+    "rollout_epsilon",
+    "rollout_temperature",
+    "widening_k",
+    "widening_alpha",
 ]
 
 
+def load_heuristic(spec, problem, risk_factor=None):
+    """Load a heuristic plugin given as 'module:function', or a built-in heuristic.
+
+    The function is called with the problem and must return the heuristic, a function
+    from states to floats. A built-in heuristic is given by its name in
+    `phgn_planner.heuristics.HEURISTICS`, and its estimates are turned into utilities
+    with `risk_factor` if given, and into goal probabilities otherwise.
+    """
+    if spec in HEURISTICS:
+        heuristic = HEURISTICS[spec](problem)
+        if risk_factor is None:
+            return heuristic.goal_probability()
+        return heuristic.utility(risk_factor)
+    module_name, _, function_name = spec.partition(":")
+    if not function_name:
+        raise ValueError(
+            f"Expected a heuristic of the form 'module:function', got '{spec}'"
+        )
+    factory = getattr(importlib.import_module(module_name), function_name)
+    return factory(problem)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Run a PHGN probabilistic planning algorithm and log results."
@@ -76,6 +120,116 @@ def main():
         default=100,
         help="The maximum cost budget for a single run (default: 100).",
     )
+    parser.add_argument(
+        "--playout-depth",
+        type=int,
+        default=None,
+        help="Steps after which rollouts are estimated heuristically (default: None).",
+    )
+    parser.add_argument(
+        "--n-init",
+        type=int,
+        default=0,
+        help="Visits which the prior of each progression is worth (default: 0).",
+    )
+    parser.add_argument(
+        "--h-util",
+        type=str,
+        default=None,
+        help="Utility heuristic, built-in (goal_count, hmax, hadd, ff) or "
+        "'module:function' (default: constant 1, goal_count at --playout-depth).",
+    )
+    parser.add_argument(
+        "--h-ptg",
+        type=str,
+        default=None,
+        help="Probability-to-goal heuristic, built-in (goal_count, hmax, hadd, ff) or "
+        "'module:function' (default: constant 1, goal_count at --playout-depth).",
+    )
+    parser.add_argument(
+        "--n-workers",
+        type=int,
+        default=1,
+        help="Number of worker processes for root-parallel UCT (default: 1).",
+    )
+    parser.add_argument(
+        "--n-threads",
+        type=int,
+        default=1,
+        help="Number of threads for tree-parallel UCT (default: 1).",
+    )
+    parser.add_argument(
+        "--time-per-decision",
+        type=float,
+        default=None,
+        help="Seconds to search before each decision instead of --n-rollouts (default: None).",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=None,
+        help="The maximum time budget in seconds for a single run (default: None).",
+    )
+    parser.add_argument(
+        "--early-stop-interval",
+        type=int,
+        default=None,
+        help="Rollouts between checks for stopping a decision early (default: None).",
+    )
+    parser.add_argument(
+        "--max-nodes",
+        type=int,
+        default=None,
+        help="Maximum number of stored tree nodes (default: None).",
+    )
+    parser.add_argument(
+        "--eviction-policy",
+        type=str,
+        default="lru",
+        choices=["lru", "visits"],
+        help="Which leaves to evict first when the node store is full (default: lru).",
+    )
+    parser.add_argument(
+        "--undo-goal-network",
+        action="store_true",
+        help="Roll back one shared goal network after each rollout instead of copying it.",
+    )
+    parser.add_argument(
+        "--chance-nodes",
+        action="store_true",
+        help="Enumerate the outcomes of probabilistic actions as chance nodes.",
+    )
+    parser.add_argument(
+        "--expectation-backup",
+        action="store_true",
+        help="Back up expectations over outcomes at chance nodes.",
+    )
+    parser.add_argument(
+        "--rollout-policy",
+        type=str,
+        default="random",
+        choices=["random", "helpful", "epsilon_greedy", "boltzmann"],
+        help="How rollouts choose among applicable progressions (default: random).",
+    )
+    parser.add_argument(
+        "--rollout-heuristic",
+        type=str,
+        default="goal_count",
+        choices=sorted(HEURISTICS),
+        help="Heuristic guiding the greedy and Boltzmann policies (default: goal_count).",
+    )
+    parser.add_argument(
+        "--widening-k",
+        type=float,
+        default=None,
+        help="Progressive widening coefficient k of k*N^alpha (default: None, off).",
+    )
+    parser.add_argument(
+        "--widening-alpha",
+        type=float,
+        default=0.5,
+        help="Progressive widening exponent alpha of k*N^alpha (default: 0.5).",
+    )
 
     args = parser.parse_args()
 
@@ -123,24 +277,49 @@ def main():
         return
 
     # --- 3. Configure UCT parameters ---
-    # Note: h_util and h_ptg are excluded as requested for logging
+    # Note: h_util and h_ptg are logged by the specs they were loaded from
+    risk_factor = -0.1
+    try:
+        h_util = (
+            load_heuristic(args.h_util, problem, risk_factor) if args.h_util else None
+        )
+        h_ptg = load_heuristic(args.h_ptg, problem) if args.h_ptg else None
+    except (ValueError, ModuleNotFoundError, AttributeError) as e:
+        print(f"Error loading heuristic: {e}", flush=True)
+        return
     cfg = UCTConfig(
         n_rollouts=args.n_rollouts,
         horizon=args.horizon,
         budget=args.budget,
         exploration_const=2**0.5,
         normalize_exploration_const=True,
-        n_init=5,
-        risk_factor=-0.1,
+        n_init=args.n_init,
+        risk_factor=risk_factor,
         goal_utility=1,
-        h_util=lambda _: 1,
-        h_ptg=lambda _: 1,
+        h_util=h_util,
+        h_ptg=h_ptg,
         seed=None,
+        n_workers=args.n_workers,
+        n_threads=args.n_threads,
+        time_per_decision=args.time_per_decision,
+        time_budget=args.time_budget,
+        early_stop_interval=args.early_stop_interval,
+        max_nodes=args.max_nodes,
+        eviction_policy=args.eviction_policy,
+        undo_goal_network=args.undo_goal_network,
+        chance_nodes=args.chance_nodes,
+        expectation_backup=args.expectation_backup,
+        playout_depth=args.playout_depth,
+        rollout_policy=args.rollout_policy,
+        rollout_heuristic=args.rollout_heuristic,
+        widening_k=args.widening_k,
+        widening_alpha=args.widening_alpha,
         show_progress=True,
     )
 
     print(f"Running planner with variant: {args.variant}", flush=True)
     # --- 4. Run the planner ---
+    planner = None
     try:
         planner = PHGNPlanner(cfg)
         result, cost, num_nodes = planner.run(problem)
@@ -148,6 +327,7 @@ def main():
             f"Planner finished. Result: '{result}', Cost: {cost}, Num nodes: {num_nodes}",
             flush=True,
         )
+        print(planner.stats.summary(), flush=True)
     except Exception as e:
         print(f"An error occurred during planner execution: {e}", flush=True)
         result = "ERROR"
@@ -167,7 +347,10 @@ def main():
         "result",
         "cost",
         "num_nodes",
-    ] + UCT_CONFIG_PARAMS_TO_LOG
+        "h_util",
+        "h_ptg",
+    ]
+    fieldnames += UCT_CONFIG_PARAMS_TO_LOG + list(SUMMARY_FIELDS)
 
     # Create the data row dictionary
     row_data = {
@@ -177,12 +360,18 @@ def main():
         "result": result,
         "cost": cost,
         "num_nodes": num_nodes,
+        "h_util": args.h_util,
+        "h_ptg": args.h_ptg,
     }
 
     # Add UCTConfig parameters to the row_data
     for param_name in UCT_CONFIG_PARAMS_TO_LOG:
         row_data[param_name] = getattr(cfg, param_name)
 
+    # Add the statistics of the run, left empty if the planner failed to start
+    if planner is not None and planner.stats is not None:
+        row_data.update(planner.stats.get_summary())
+
     # --- 6. Write results to CSV ---
     try:
         with open(args.output_file, "a", newline="") as csvfile:
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import threading
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+
+import numpy as np
+from unified_planning.model.fnode import FNode
+from unified_planning.model.walkers import StateEvaluator
+
+if TYPE_CHECKING:
+    from unified_planning.engines.compilers import PHGNGrounderHelper
+    from unified_planning.model.phgn.phgn_problem import PHGNProblem
+
+
+class ChanceNode[S]:
+    """The enumerated outcomes of a probabilistic action at one state.
+
+    Outcomes are sampled by index in constant time with an alias table (Vose's alias
+    method). A ChanceNode also keeps the mean backed-up value of each outcome, per row
+    of the statistics of its TreeNode, for expectation backups (see `backup`).
+
+    Parameters
+    ----------
+    outcomes : Iterable[tuple[float, S]]
+        The probability and successor state of each outcome.
+    """
+
+    __slots__ = (
+        "states",
+        "probabilities",
+        "_prob",
+        "_alias",
+        "N",
+        "Q",
+        "_prior_n",
+        "_prior_q",
+    )
+
+    def __init__(self, outcomes: Iterable[tuple[float, S]]) -> None:
+        probabilities, states = zip(*outcomes)
+        self.states: list[S] = list(states)
+        self.probabilities: np.ndarray = np.array(probabilities, dtype=float)
+        self.probabilities /= self.probabilities.sum()
+        self._prob, self._alias = _alias_table(self.probabilities)
+        # one row per outcome, one column per row of the TreeNode statistics
+        self.N: np.ndarray = np.zeros((len(self.states), 0))
+        self.Q: np.ndarray = np.zeros((len(self.states), 0))
+        # the visits and Q value of each row before its first backup
+        self._prior_n: np.ndarray = np.zeros(0)
+        self._prior_q: np.ndarray = np.zeros(0)
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def sample(self, rng: np.random.RandomState) -> int:
+        """Return the index of a random outcome."""
+        i = rng.randint(len(self._prob))
+        return i if rng.random_sample() < self._prob[i] else self._alias[i]
+
+    def backup(
+        self,
+        outcome: int,
+        rows: np.ndarray,
+        values: np.ndarray,
+        n: np.ndarray,
+        q: np.ndarray,
+    ) -> np.ndarray:
+        """Add `values` to the means of `outcome` at `rows`, and return Q values.
+
+        `n` and `q` are the visits and Q values of the action at `rows` before this
+        backup. The expectation of each row is taken over the outcomes which have been
+        backed up at that row, weighted by their renormalized probabilities, and is
+        blended with the prior of the row: the visits and Q value it had before its
+        first backup, e.g. seeded with `n_init` visits. The returned Q values thus
+        weigh the prior as much as the visits which the TreeNode counts for it. The
+        caller must hold the lock of the TreeNode which owns this ChanceNode.
+        """
+        if rows.size and rows.max() >= self.N.shape[1]:
+            width = rows.max() + 1 - self.N.shape[1]
+            self.N = np.pad(self.N, ((0, 0), (0, width)))
+            self.Q = np.pad(self.Q, ((0, 0), (0, width)))
+            self._prior_n = np.pad(self._prior_n, (0, width))
+            self._prior_q = np.pad(self._prior_q, (0, width))
+        backups = self.N[:, rows].sum(axis=0)
+        first = backups == 0
+        self._prior_n[rows[first]] = n[first]
+        self._prior_q[rows[first]] = q[first]
+        m = self.N[outcome, rows]
+        self.Q[outcome, rows] = (m * self.Q[outcome, rows] + values) / (1 + m)
+        self.N[outcome, rows] += 1
+        weights = self.probabilities[:, np.newaxis] * (self.N[:, rows] > 0)
+        expectation = (weights * self.Q[:, rows]).sum(axis=0) / weights.sum(axis=0)
+        prior_n = self._prior_n[rows]
+        return (prior_n * self._prior_q[rows] + (backups + 1) * expectation) / (
+            prior_n + backups + 1
+        )
+
+
+class OutcomeEnumerator[S]:
+    """Enumerates the outcomes of ground ProbabilisticActions, for ChanceNodes.
+
+    The successor state of each outcome is made from the effects of the outcome, as in
+    the all-outcomes determinization of `RelaxedTask`, without sampling: conditional
+    effects only apply when their condition holds in the state, increases and
+    decreases are added to the current value, and a boolean fluent which is both
+    deleted and added ends up added.
+
+    Parameters
+    ----------
+    problem : PHGNProblem
+        The problem whose actions are enumerated.
+    grounder : PHGNGrounderHelper
+        The grounder of the actions of `problem`.
+    """
+
+    def __init__(self, problem: PHGNProblem, grounder: PHGNGrounderHelper) -> None:
+        self._grounder = grounder
+        self._expression_manager = problem.environment.expression_manager
+        self._evaluator = StateEvaluator(problem)
+        # a StateEvaluator keeps the state it is evaluating
+        self._lock = threading.Lock()
+
+    def get_outcomes(self, state: S, action, params: tuple) -> list[tuple[float, S]]:
+        """Return the probability and successor state of each outcome of `action`."""
+        ground_action = self._grounder.ground_action(action, params)
+        em = self._expression_manager
+        outcomes = []
+        with self._lock:
+            for outcome in ground_action.outcomes:
+                values: dict[FNode, FNode] = {}
+                for effect in ground_action.effects[outcome]:
+                    if effect.is_conditional() and not self._evaluate(
+                        effect.condition, state
+                    ).is_true():
+                        continue
+                    fluent = effect.fluent
+                    value = self._evaluate(effect.value, state)
+                    if effect.is_increase() or effect.is_decrease():
+                        current = values.get(fluent, state.get_value(fluent))
+                        change = em.Plus if effect.is_increase() else em.Minus
+                        value = self._evaluate(change(current, value), state)
+                    elif fluent in values and value.is_false():
+                        continue
+                    values[fluent] = value
+                probability = float(ground_action.outcomes[outcome])
+                outcomes.append((probability, state.make_child(values)))
+        return outcomes
+
+    def _evaluate(self, expression: FNode, state: S) -> FNode:
+        return self._evaluator.evaluate(expression, state)
+
+
+def _alias_table(probabilities: np.ndarray) -> tuple[list[float], list[int]]:
+    # Vose's alias method: outcome i is kept with probability prob[i], and replaced by
+    # alias[i] otherwise
+    n = len(probabilities)
+    scaled = list(probabilities * n)
+    prob = [1.0] * n
+    alias = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        i, j = small.pop(), large.pop()
+        prob[i] = scaled[i]
+        alias[i] = j
+        scaled[j] -= 1 - scaled[i]
+        (small if scaled[j] < 1 else large).append(j)
+    return prob, alias
@@ -21,19 +21,98 @@ class UCTConfig:
     normalize_exploration_const : bool
         whether to normalize c in UCB (default = True)
     n_init : int
-        initial visit count (delta) (default = 5)
+        initial visit count (delta): every progression considered at a node starts
+        with `n_init` visits of value h_util(s) + h_ptg(s) * goal_utility, where s is
+        the state it leads to; 0 disables the priors (default = 0)
     greediness : float
         greediness value (alpha) for LAMP (default = 0.5)
     risk_factor : float
         risk factor (lambda) for GUBS criterion (default = -0.1)
     goal_utility : float
         goal utility constant for GUBS criterion (default = 1)
-    h_util : Callable[[frozenset[Literal]], float]
-        utility heuristic (default = lambda _: 1)
-    h_ptg : Callable[[frozenset[Literal]], float]
-        probability-to-goal heuristic (default = lambda _: 1)
+    h_util : Optional[Callable[[frozenset[Literal]], float]]
+        utility heuristic, e.g. the `utility` of a heuristic from
+        `phgn_planner.heuristics`; if None, 1 everywhere, except at the states where
+        rollouts are cut off by `playout_depth`, which are estimated with the goal
+        count heuristic (default = None)
+    h_ptg : Optional[Callable[[frozenset[Literal]], float]]
+        probability-to-goal heuristic, e.g. the `goal_probability` of a heuristic from
+        `phgn_planner.heuristics`; if None, 1 everywhere, except at the states where
+        rollouts are cut off by `playout_depth`, as for `h_util` (default = None)
     seed : Optional[int]
         random seed (default = None)
+    n_workers : int
+        number of worker processes for root-parallel UCT; each worker searches its own
+        tree with an independent RNG stream and the root statistics are merged before
+        the best action is chosen (default = 1)
+    n_threads : int
+        number of threads for tree-parallel UCT; threads run concurrent descents over
+        the shared search tree, which only scales on free-threaded builds (default = 1)
+    virtual_loss : int
+        number of losing visits temporarily added to a progression while a thread is
+        descending through it, so that concurrent threads spread out (default = 1)
+    time_per_decision : Optional[float]
+        wall-clock time (in seconds) to search before each decision; if set, rollouts
+        are performed until the deadline instead of `n_rollouts` (default = None)
+    time_budget : Optional[float]
+        wall-clock time (in seconds) for a single run; without `time_per_decision`, the
+        remaining time is shared evenly between the decisions the remaining cost budget
+        allows, and the run fails once it is used up (default = None)
+    early_stop_interval : Optional[int]
+        if set, check the root statistics every `early_stop_interval` rollouts and stop
+        searching once the leading progression is statistically separated from all
+        others, or if there is only one progression (default = None)
+    early_stop_confidence : float
+        confidence level of the Hoeffding bounds used for early stopping
+        (default = 0.95)
+    max_nodes : Optional[int]
+        maximum number of TreeNodes stored at once; when exceeded, nodes are evicted
+        between rollouts, leaves first, but never the current root or a node which a
+        search is descending through (default = None, unbounded)
+    eviction_policy : str
+        which nodes are evicted first, after leaves, "lru" (least recently visited)
+        or "visits" (lowest visit count) (default = "lru")
+    prune_tree : bool
+        whether to free the TreeNodes which are no longer reachable after each
+        decision; the nodes within `horizon` steps below the new root are kept
+        (default = True)
+    undo_goal_network : bool
+        whether rollouts of the factored planner modify one shared goal network and
+        roll it back afterwards, instead of each modifying a copy (default = False)
+    chance_nodes : bool
+        whether probabilistic actions in the tree are chance nodes, whose outcomes are
+        enumerated once per state from the outcomes and effects of the action and then
+        sampled by the planner (default = False)
+    expectation_backup : bool
+        whether the Q value of a chance node is backed up as the expectation over its
+        outcomes instead of the mean of the sampled results; requires `chance_nodes`
+        (default = False)
+    playout_depth : Optional[int]
+        if set, a rollout beyond the search tree stops after `playout_depth` steps, and
+        the rest of it is estimated from the state s it stopped in: the remaining cost
+        is the one whose utility is h_util(s), and every remaining subgoal is achieved
+        with probability h_ptg(s). If h_util(s) is 0, s is treated as a dead end
+        (default = None, rollouts run to the horizon)
+    rollout_policy : str
+        how rollouts and newly expanded nodes select progressions: "random"
+        (uniformly), "helpful" (preferring relevant methods and actions which achieve an
+        unconstrained subgoal), or "epsilon_greedy" and "boltzmann" (on the estimates
+        of the `rollout_heuristic` at the successor states) (default = "random")
+    rollout_heuristic : str
+        the heuristic of the "epsilon_greedy" and "boltzmann" rollout policies, one of
+        "goal_count", "hmax", "hadd" and "ff" (default = "goal_count")
+    rollout_epsilon : float
+        probability that the "epsilon_greedy" rollout policy selects a progression
+        uniformly at random (default = 0.1)
+    rollout_temperature : float
+        temperature of the "boltzmann" rollout policy (default = 1.0)
+    widening_k : Optional[float]
+        if set, UCB selection at a node visited n times only considers its first
+        max(1, floor(widening_k * n^widening_alpha)) progressions (progressive
+        widening), ranked by the estimates of a heuristic rollout policy if one is
+        used, then by their prior Q values (default = None, every progression)
+    widening_alpha : float
+        growth exponent of progressive widening, in (0, 1] (default = 0.5)
     show_progress : bool
         whether to print planning progress to stdout (default = False)
     """
@@ -45,10 +124,30 @@ class UCTConfig:
         2**0.5
     )  # exploration-exploitation tradeoff (c) value for UCB
     normalize_exploration_const: bool = True  # whether to normalize c in UCB
-    n_init: int = 5  # initial visit count (delta)
+    n_init: int = 0  # initial visit count (delta)
     risk_factor: float = -0.1  # risk factor (lambda) for GUBS criterion
     goal_utility: float = 1  # goal utility constant for GUBS criterion
-    h_util: Callable[[UPState], float] = lambda _: 1  # utility heuristic
-    h_ptg: Callable[[UPState], float] = lambda _: 1  # probability-to-goal heuristic
+    h_util: Callable[[UPState], float] | None = None  # utility heuristic
+    h_ptg: Callable[[UPState], float] | None = None  # probability-to-goal heuristic
     seed: int | None = None  # random seed
+    n_workers: int = 1  # number of worker processes for root-parallel UCT
+    n_threads: int = 1  # number of threads for tree-parallel UCT
+    virtual_loss: int = 1  # losing visits added to a progression during a descent
+    time_per_decision: float | None = None  # time to search before each decision
+    time_budget: float | None = None  # the maximum time budget for a single run
+    early_stop_interval: int | None = None  # rollouts between early stopping checks
+    early_stop_confidence: float = 0.95  # confidence level for early stopping
+    max_nodes: int | None = None  # maximum number of stored nodes
+    eviction_policy: str = "lru"  # which nodes to evict first ("lru" or "visits")
+    prune_tree: bool = True  # whether to free unreachable nodes after each decision
+    undo_goal_network: bool = False  # whether to roll back one shared goal network
+    chance_nodes: bool = False  # whether probabilistic actions are chance nodes
+    expectation_backup: bool = False  # whether chance nodes back up expectations
+    playout_depth: int | None = None  # steps of a rollout before it is estimated
+    rollout_policy: str = "random"  # how rollouts select progressions
+    rollout_heuristic: str = "goal_count"  # heuristic of the rollout policy
+    rollout_epsilon: float = 0.1  # exploration probability of "epsilon_greedy"
+    rollout_temperature: float = 1.0  # temperature of "boltzmann"
+    widening_k: float | None = None  # progressions considered at a node visited once
+    widening_alpha: float = 0.5  # growth exponent of progressive widening
     show_progress: bool = False  # whether to print planning progress to stdout
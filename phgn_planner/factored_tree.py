@@ -1,82 +1,340 @@
 from __future__ import annotations
 
-from abc import ABC, abstractmethod
-from collections import defaultdict
-from collections.abc import Callable, Hashable
-from math import log, sqrt
+import heapq
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterable, Iterator
+from math import sqrt
 from typing import TYPE_CHECKING
 
 import numpy as np
-from unified_planning.model.phgn.goal_network import PartialOrderGoalNetwork
 from unified_planning.engines.phgn_simulator import PHGNSimulator
+from unified_planning.model.action import ProbabilisticAction
 from unified_planning.model.phgn import PHGNMethod
+from phgn_planner.chance import ChanceNode, OutcomeEnumerator
+from phgn_planner.fingerprint import StateFingerprinter
+from phgn_planner.goal_network import CompiledGoalNetwork, GoalNetworkCompiler
+from phgn_planner.policies import (
+    HeuristicPolicy,
+    NodeAccess,
+    ProgressiveWidening,
+    TreePolicy,
+    choose_max,
+    ucb_values,
+)
 
 
 if TYPE_CHECKING:
     from phgn_planner.factored_uct import RolloutResult
 
 
+EVICTION_POLICIES = ("lru", "visits")
+
+# the number of frontiers whose relevance and rankings a TreeNode caches
+_MAX_FRONTIERS = 8
+
+
 class TreeNodeFactory[S: Hashable, A: Hashable, M: Hashable, G: Hashable]:
     """A factory for TreeNodes.
 
-    Ensures that there is only one node created for each underlying state.
+    Ensures that there is only one node created for each underlying state. Nodes are
+    stored by the fingerprint of their state, and the rare states whose fingerprint is
+    already taken by a different state are stored by the state itself.
+
+    Parameters
+    ----------
+    simulator : PHGNSimulator
+        The simulator used by the created TreeNodes.
+    compiler : GoalNetworkCompiler
+        The compiler of the goal networks, which decides the relevant methods of the
+        created TreeNodes. Its interned subgoals are shared by the created TreeNodes.
+    max_nodes : Optional[int]
+        The maximum number of stored TreeNodes. Once exceeded, `enforce_capacity` evicts
+        nodes until 90% of the capacity is used. If None, the store is unbounded.
+    eviction_policy : str
+        Which nodes are evicted first, after leaves: the least recently visited
+        ("lru") or those with the lowest visit count ("visits").
+    fingerprints : Optional[StateFingerprinter]
+        The fingerprints of the states. If None, states are fingerprinted by their hash.
+    q_init : Optional[Callable]
+        The prior Q value of a progression at a state (see `TreeNode`). If None, the
+        statistics of the created TreeNodes start at zero.
+    n_init : int
+        The number of visits which the prior Q value of each progression is worth.
     """
 
-    def __init__(self, simulator: PHGNSimulator):
+    def __init__(
+        self,
+        simulator: PHGNSimulator,
+        compiler: GoalNetworkCompiler[G],
+        max_nodes: int | None = None,
+        eviction_policy: str = "lru",
+        fingerprints: StateFingerprinter | None = None,
+        q_init: Callable[[S, A | M], float] | None = None,
+        n_init: int = 0,
+    ):
+        if eviction_policy not in EVICTION_POLICIES:
+            raise ValueError(
+                f"Unknown eviction policy '{eviction_policy}', "
+                f"expected one of {EVICTION_POLICIES}"
+            )
         self._simulator = simulator
-        self._nodes = {}
+        self._compiler = compiler
+        self._nodes: dict[int, TreeNode] = {}
+        self._collisions: dict[S, TreeNode] = {}
         self._num_nodes = 0
-
-    def new_node(self, state: S) -> TreeNode:
+        self._lock = threading.Lock()
+        self.max_nodes = max_nodes
+        self.eviction_policy = eviction_policy
+        self._clock = 0
+        self.fingerprints = fingerprints
+        self.q_init = q_init
+        self.n_init = n_init
+
+    def new_node(
+        self, state: S, fingerprint: int | None = None, pin: bool = False
+    ) -> TreeNode:
         """Create a new TreeNode.
 
         Creates a new TreeNode only if the underlying state has not
         yet been encountered. If it has, return the existing instance.
+        `fingerprint` is the fingerprint of `state` (see `StateFingerprinter.update`),
+        which is computed from scratch if None. If `pin`, the returned node is pinned
+        atomically, and is not evicted until it is unpinned (see `unpin`).
+        """
+        if fingerprint is None:
+            fingerprint = (
+                hash(state)
+                if self.fingerprints is None
+                else self.fingerprints.fingerprint(state)
+            )
+        with self._lock:
+            node = self._find(state, fingerprint)
+            if node is None:
+                node = TreeNode[S, A, M, G](
+                    state,
+                    fingerprint,
+                    self._simulator,
+                    self._compiler,
+                    self.q_init,
+                    self.n_init,
+                )
+                self._insert(node)
+                self._num_nodes += 1
+            if pin:
+                node.pins += 1
+            node.last_visit = self._clock
+            self._clock += 1
+            return node
+
+    def new_child(self, parent: TreeNode, state: S, pin: bool = False) -> TreeNode:
+        """Create a new TreeNode for `state`, a successor of the state of `parent`.
+
+        The fingerprint of `state` is updated from the one of `parent`, and the node is
+        pinned if `pin` (see `new_node`).
         """
-        if state not in self._nodes:
-            self._nodes[state] = TreeNode[S, A, M, G](state, self._simulator)
-            self._num_nodes += 1
-        return self._nodes[state]
+        fingerprint = (
+            None
+            if self.fingerprints is None
+            else self.fingerprints.update(parent.fingerprint, parent.state, state)
+        )
+        return self.new_node(state, fingerprint, pin)
+
+    def unpin(self, nodes: Iterable[TreeNode]) -> None:
+        """Release the pins taken on `nodes` by `new_node`, once for each occurrence."""
+        with self._lock:
+            for node in nodes:
+                node.pins -= 1
 
     def num_nodes(self) -> int:
         return self._num_nodes
 
+    def num_stored_nodes(self) -> int:
+        return len(self._nodes) + len(self._collisions)
+
+    def prune(self, root: TreeNode, max_depth: int | None = None) -> int:
+        """Free every TreeNode which is not reachable from `root`.
+
+        Reachability follows the children recorded during search, so the statistics of
+        the subtree below `root` are kept for later decisions. If `max_depth` is given,
+        only the nodes within `max_depth` steps of `root` are kept, which bounds the
+        kept nodes even when the recorded children form cycles. Returns the number of
+        nodes freed.
+        """
+        reachable = root.get_subtree(max_depth)
+        with self._lock:
+            num_stored = self.num_stored_nodes()
+            self._nodes = {}
+            self._collisions = {}
+            for node in reachable:
+                self._insert(node)
+                node.children &= reachable
+            return num_stored - len(reachable)
+
+    def enforce_capacity(self, root: TreeNode) -> int:
+        """Evict TreeNodes if more than `max_nodes` are stored.
+
+        Nodes are evicted according to the eviction policy until 90% of the capacity
+        is used, leaves before interior nodes. `root`, and every node pinned by a search
+        which is still descending through it (see `new_node`), is never evicted, so
+        the capacity cannot be met if there are too many of them (see
+        `is_over_capacity`). Returns the number of nodes evicted.
+        """
+        if not self.is_over_capacity():
+            return 0
+        with self._lock:
+            nodes = list(self._iter_nodes())
+            candidates = [
+                node for node in nodes if not (node.pins or node is root)
+            ]
+            key = (
+                (lambda node: (bool(node.children), node.last_visit))
+                if self.eviction_policy == "lru"
+                else (
+                    lambda node: (
+                        bool(node.children),
+                        node.num_visits(),
+                        node.last_visit,
+                    )
+                )
+            )
+            num_evict = len(nodes) - int(0.9 * self.max_nodes)
+            evicted = set(heapq.nsmallest(num_evict, candidates, key=key))
+            for node in evicted:
+                self._remove(node)
+            for node in nodes:
+                if node.children and node not in evicted:
+                    node.children -= evicted
+            return len(evicted)
+
+    def is_over_capacity(self) -> bool:
+        """Whether more than `max_nodes` TreeNodes are stored."""
+        return self.max_nodes is not None and self.num_stored_nodes() > self.max_nodes
+
+    def _find(self, state: S, fingerprint: int) -> TreeNode | None:
+        node = self._nodes.get(fingerprint)
+        if node is not None and (node.state is state or node.state == state):
+            return node
+        if self._collisions:
+            return self._collisions.get(state)
+        return None
+
+    def _insert(self, node: TreeNode) -> None:
+        if node.fingerprint in self._nodes:
+            # a different state has the same fingerprint
+            self._collisions[node.state] = node
+        else:
+            self._nodes[node.fingerprint] = node
+
+    def _iter_nodes(self) -> Iterator[TreeNode]:
+        yield from self._nodes.values()
+        yield from self._collisions.values()
+
+    def _remove(self, node: TreeNode) -> None:
+        if self._nodes.get(node.fingerprint) is node:
+            del self._nodes[node.fingerprint]
+        else:
+            del self._collisions[node.state]
+
 
 class TreeNode[S: Hashable, A: Hashable, M: Hashable, G: Hashable]:
-    """A decision node in a Monte Carlo search tree."""
+    """A decision node in a Monte Carlo search tree.
+
+    The statistics are stored in arrays with one row per subgoal which has been updated
+    or looked up at this node (see `get_goal_row`), and one column per applicable action
+    or method (see `get_index`).
+
+    If `q_init` is given, every progression u considered at this node (see
+    `seed_priors`) starts with `n_init` visits of value `q_init(state, u)` in each row,
+    where state is the successor of this node's state if u is a deterministic action,
+    and this node's state otherwise.
+    """
+
+    __slots__ = (
+        "state",
+        "fingerprint",
+        "_simulator",
+        "_appliable_actions",
+        "_applicable_methods",
+        "_index",
+        "_compiler",
+        "_goals",
+        "_rows",
+        "visits",
+        "Q",
+        "N",
+        "_expanded",
+        "_lock",
+        "virtual_loss",
+        "total_virtual_loss",
+        "pins",
+        "children",
+        "last_visit",
+        "_successors",
+        "_chance_nodes",
+        "_relevance",
+        "_rankings",
+        "_q_init",
+        "n_init",
+        "_prior",
+        "_seeded",
+    )
 
-    def __init__(self, state: S, simulator: PHGNSimulator) -> None:
+    def __init__(
+        self,
+        state: S,
+        fingerprint: int,
+        simulator: PHGNSimulator,
+        compiler: GoalNetworkCompiler[G],
+        q_init: Callable[[S, A | M], float] | None = None,
+        n_init: int = 0,
+    ) -> None:
         self.state: S = state
+        self.fingerprint: int = fingerprint
         self._simulator: PHGNSimulator = simulator
         self._appliable_actions: set[A] | None = None
         self._applicable_methods: set[M] | None = None
-        self.visits: dict[G, int] = defaultdict(int)
-        self.Q: dict[G, dict[A | M, float]] = defaultdict(lambda: defaultdict(float))
-        self.N: dict[G, dict[A | M, int]] = defaultdict(lambda: defaultdict(int))
+        self._index: dict[A | M, int] | None = None
+        self._compiler: GoalNetworkCompiler[G] = compiler
+        self._goals = compiler.goals
+        self._rows: dict[int, int] = {}  # the row of each subgoal ID
+        self.visits: np.ndarray = np.zeros(0, dtype=int)
+        self.Q: np.ndarray = np.zeros((0, 0))
+        self.N: np.ndarray = np.zeros((0, 0))
         self._expanded: bool = False
+        self._lock = threading.Lock()
+        self.virtual_loss: np.ndarray = np.zeros(0, dtype=int)
+        self.total_virtual_loss: int = 0
+        self.pins: int = 0  # the searches descending through this node
+        self.children: set[TreeNode] = set()
+        self.last_visit: int = 0
+        self._successors: dict[A, S] = {}
+        self._chance_nodes: dict[A, ChanceNode[S]] = {}
+        # LRU caches keyed by the frontiers of the goal networks seen at this node
+        self._relevance: OrderedDict[tuple, tuple[list[A | M], dict[M, tuple]]] = (
+            OrderedDict()
+        )
+        self._rankings: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._q_init = q_init
+        self.n_init: int = n_init if q_init is not None else 0
+        self._prior: np.ndarray = np.zeros(0)
+        self._seeded: np.ndarray = np.zeros(0, dtype=bool)
 
     def __str__(self):
         s = f"Expanded: {self._expanded}\n"
         s += "Applicable Actions/Methods:\n"
-        for a in self.get_applicable_actions():
-            for subgoal in self.Q:
+        for u, j in self.get_index().items():
+            for goal_id, i in self._rows.items():
+                subgoal = self._goals.get_goal(goal_id)
                 s += (
-                    f"  {a[0].name, a[1]}, {subgoal}: Q={self.Q[subgoal][a]}, N={self.N[subgoal][a]}\n"
-                    if self.N[subgoal][a] > 0
+                    f"  {u[0].name, u[1]}, {subgoal}: Q={self.Q[i, j]}, N={self.N[i, j]}\n"
+                    if self.N[i, j] > 0
                     else ""
                 )
-        for m in self.get_applicable_methods():
-            for subgoal in self.Q:
-                s += (
-                    f"  {m[0].name, m[1]}, {subgoal}: Q={self.Q[subgoal][m]}, N={self.N[subgoal][m]}\n"
-                    if self.N[subgoal][m] > 0
-                    else ""
-                )
-        for subgoal in self.visits:
+        for goal_id, i in self._rows.items():
+            subgoal = self._goals.get_goal(goal_id)
             s += (
-                f"Visits {subgoal}: {self.visits[subgoal]}\n"
-                if self.visits[subgoal] > 0
-                else ""
+                f"Visits {subgoal}: {self.visits[i]}\n" if self.visits[i] > 0 else ""
             )
         return s
 
@@ -97,7 +355,7 @@ class TreeNode[S: Hashable, A: Hashable, M: Hashable, G: Hashable]:
 
     def get_applicable_actions(self) -> set[A]:
         """Generate and return the set of applicable actions at this decision node."""
-        if not self._appliable_actions:
+        if self._appliable_actions is None:
             self._appliable_actions = set(
                 self._simulator.get_applicable_actions(self.state)
             )
@@ -105,23 +363,262 @@ class TreeNode[S: Hashable, A: Hashable, M: Hashable, G: Hashable]:
 
     def get_applicable_methods(self) -> set[M]:
         """Generate and return the set of applicable actions at this decision node."""
-        if not self._applicable_methods:
+        if self._applicable_methods is None:
             self._applicable_methods = set(
                 self._simulator.get_applicable_methods(self.state)
             )
         return self._applicable_methods
 
+    def get_index(self) -> dict[A | M, int]:
+        """Return the column of each applicable progression in the statistics arrays.
+
+        The index covers every applicable action and method, and is built (and the
+        arrays allocated) the first time it is needed.
+        """
+        if self._index is None:
+            progressions = list(self.get_applicable_actions()) + list(
+                self.get_applicable_methods()
+            )
+            with self._lock:
+                if self._index is None:
+                    self._prior = np.zeros(len(progressions))
+                    self._seeded = np.zeros(len(progressions), dtype=bool)
+                    self.Q = np.zeros((len(self.visits), len(progressions)))
+                    self.N = np.zeros((len(self.visits), len(progressions)))
+                    self.virtual_loss = np.zeros(len(progressions), dtype=int)
+                    self._index = {u: j for j, u in enumerate(progressions)}
+        return self._index
+
+    def seed_priors(self, columns: np.ndarray) -> None:
+        """Seed the progressions in `columns` with their priors, if not done yet.
+
+        Priors are only computed for the progressions considered at this node, e.g.
+        those relevant to its goal network, since the prior of a deterministic action
+        is computed at its successor.
+        """
+        if not self.n_init:
+            return
+        index = self.get_index()
+        new = columns[~self._seeded[columns]]
+        if not new.size:
+            return
+        progressions = list(index)
+        prior = np.array([self._get_prior(progressions[j]) for j in new])
+        with self._lock:
+            fresh = ~self._seeded[new]
+            new, prior = new[fresh], prior[fresh]
+            n = self.N[:, new]
+            self.Q[:, new] = (n * self.Q[:, new] + self.n_init * prior) / (
+                n + self.n_init
+            )
+            self.N[:, new] += self.n_init
+            self.visits += self.n_init * len(new)
+            self._prior[new] = prior
+            self._seeded[new] = True
+
+    def _get_prior(self, u: A | M) -> float:
+        # the prior Q value of u, see the class docstring
+        deterministic = not isinstance(u[0], (ProbabilisticAction, PHGNMethod))
+        state = self.get_successor(u) if deterministic else self.state
+        return self._q_init(state, u)
+
+    def get_goal_row(self, goal: G) -> int:
+        """Return the row of `goal` in the statistics arrays, adding it if needed."""
+        goal_id = self._goals.get_id(goal)
+        row = self._rows.get(goal_id)
+        if row is None:
+            row = self.get_rows([goal_id])[0]
+        return row
+
+    def get_goal_rows(self, goals: Iterable[G]) -> np.ndarray:
+        """Return the rows of `goals` in the statistics arrays, adding any new ones."""
+        return self.get_rows(self._goals.get_ids(goals).tolist())
+
+    def get_rows(self, goal_ids: list[int]) -> np.ndarray:
+        """Return the rows of the subgoals with IDs `goal_ids`, adding any new ones."""
+        rows = self._rows
+        if any(goal_id not in rows for goal_id in goal_ids):
+            self.get_index()
+            with self._lock:
+                self._add_goal_rows(goal_ids)
+        return np.fromiter(
+            (rows[goal_id] for goal_id in goal_ids), dtype=np.intp, count=len(goal_ids)
+        )
+
+    def get_columns(self, progressions: list[A | M]) -> np.ndarray:
+        """Return the columns of `progressions` in the statistics arrays."""
+        index = self.get_index()
+        return np.fromiter(
+            (index[u] for u in progressions), dtype=np.intp, count=len(progressions)
+        )
+
+    def get_prior(self, columns: np.ndarray) -> np.ndarray:
+        """Return the prior Q values of the progressions in `columns`, 0 if unseeded."""
+        self.get_index()
+        return self._prior[columns]
+
+    def get_prior_visits(self, columns: np.ndarray) -> np.ndarray:
+        """Return the visits seeded by the priors of `columns` in each row."""
+        self.get_index()
+        return self.n_init * self._seeded[columns]
+
+    def num_prior_visits(self) -> int:
+        """The visits seeded by the priors in each row."""
+        return self.n_init * int(self._seeded.sum())
+
+    def _add_goal_rows(self, goal_ids: list[int]) -> None:
+        # add a row for each of goal_ids without one; the caller must hold self._lock
+        for goal_id in goal_ids:
+            if goal_id not in self._rows:
+                self._rows[goal_id] = len(self._rows)
+        num_new = len(self._rows) - len(self.visits)
+        if num_new > 0:
+            num_columns = self.Q.shape[1]
+            seeded = self.n_init * self._seeded
+            self.Q = np.vstack([self.Q, np.tile(self._prior, (num_new, 1))])
+            self.N = np.vstack([self.N, np.tile(seeded, (num_new, 1))])
+            self.visits = np.append(
+                self.visits, np.full(num_new, seeded.sum(), dtype=int)
+            )
+
+    def num_visits(self) -> int:
+        """The number of updates of this node, summed over subgoals."""
+        return int(self.visits.sum())
+
+    def add_child(self, child: TreeNode) -> None:
+        """Record that `child` was reached from this node during search."""
+        self.children.add(child)
+
+    def get_subtree(self, max_depth: int | None = None) -> set[TreeNode]:
+        """Return this node and the nodes reachable through its recorded children.
+
+        If `max_depth` is given, only the nodes reachable in at most `max_depth` steps
+        are returned. The recorded children may form cycles, e.g. in domains with
+        reversible actions, so the depth of a node is its shortest distance from here.
+        """
+        subtree = {self}
+        frontier = [self]
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            next_frontier = []
+            for node in frontier:
+                for child in node.children:
+                    if child not in subtree:
+                        subtree.add(child)
+                        next_frontier.append(child)
+            frontier = next_frontier
+            depth += 1
+        return subtree
+
+    def get_progressions(self, gtn: CompiledGoalNetwork) -> list[A | M]:
+        """Return the applicable actions and the methods relevant to `gtn`.
+
+        The returned list is cached, and must not be modified.
+        """
+        return self._get_relevance(gtn)[0]
+
+    def get_relevant_methods(self, gtn: CompiledGoalNetwork) -> dict[M, tuple]:
+        """Map the methods relevant to `gtn` to the positions they are relevant to.
+
+        Positions are those of the unconstrained nodes of `gtn` (see
+        `CompiledGoalNetwork.get_unconstrained_at`).
+
+        The returned dict is cached, and must not be modified.
+        """
+        return self._get_relevance(gtn)[1]
+
+    def _get_relevance(
+        self, gtn: CompiledGoalNetwork
+    ) -> tuple[list[A | M], dict[M, tuple]]:
+        # relevance only depends on the unconstrained subgoals of gtn, so it is computed
+        # once per frontier
+        def compute() -> tuple[list[A | M], dict[M, tuple]]:
+            methods = self._compiler.get_relevant_methods(
+                self.get_applicable_methods(), gtn
+            )
+            return list(self.get_applicable_actions()) + list(methods), methods
+
+        return self._get_cached(self._relevance, gtn.frontier_key(), compute)
+
+    def get_ranking(
+        self,
+        key: Hashable,
+        gtn: CompiledGoalNetwork,
+        rank: Callable[[], np.ndarray],
+    ) -> np.ndarray:
+        """Return the ranking `key` of the progressions relevant to `gtn`.
+
+        A ranking holds one value per progression of `get_progressions(gtn)`, e.g. for
+        a rollout policy. It is computed by `rank` once per frontier of `gtn`, and the
+        returned array must not be modified.
+        """
+        return self._get_cached(self._rankings, (key, gtn.frontier_key()), rank)
+
+    def _get_cached[V](
+        self, cache: OrderedDict[tuple, V], key: tuple, compute: Callable[[], V]
+    ) -> V:
+        # look up key in one of the LRU caches of this node, which only keep the values
+        # of the _MAX_FRONTIERS most recently used keys
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+        with self._lock:
+            value = cache.setdefault(key, value)
+            cache.move_to_end(key)
+            if len(cache) > _MAX_FRONTIERS:
+                cache.popitem(last=False)
+        return value
+
     def select(
         self,
         policy: TreePolicy,
-        gtn: PartialOrderGoalNetwork,
+        gtn: CompiledGoalNetwork,
     ) -> A | M:
         """Select an applicable action at this decision node according to the `policy`."""
         return policy(self, gtn)
 
+    def get_successor(self, action: A) -> S:
+        """Return the state reached by applying the applicable `action` at this node.
+
+        The successors of deterministic actions are cached, so repeated descents
+        through this node do not call the simulator again. The outcome of a
+        ProbabilisticAction is sampled on every call.
+        """
+        successor = self._successors.get(action)
+        if successor is None:
+            successor = self._simulator.apply(self.state, *action)
+            if not isinstance(action[0], ProbabilisticAction):
+                self._successors[action] = successor
+        return successor
+
+    def get_chance_node(
+        self, action: A, outcomes: OutcomeEnumerator[S]
+    ) -> ChanceNode[S]:
+        """Return the ChanceNode of the applicable ProbabilisticAction `action`.
+
+        Its outcomes are enumerated by `outcomes` the first time, and shared by all
+        later descents through this node.
+        """
+        chance_node = self._chance_nodes.get(action)
+        if chance_node is None:
+            chance_node = ChanceNode[S](outcomes.get_outcomes(self.state, *action))
+            self._chance_nodes.setdefault(action, chance_node)
+        return self._chance_nodes[action]
+
     def satisfies(self, goal: G) -> bool:
         return self._simulator.satisfies(self.state, [goal])
 
+    def add_virtual_loss(self, action_or_method: A | M, virtual_loss: int) -> None:
+        """Count `virtual_loss` losing visits of `action_or_method` until it is updated.
+
+        Used by tree-parallel search so that concurrent descents through this node are
+        steered towards different progressions.
+        """
+        j = self.get_index()[action_or_method]
+        with self._lock:
+            self.virtual_loss[j] += virtual_loss
+            self.total_virtual_loss += virtual_loss
+
     def update(
         self,
         action_or_method: A | M,
@@ -129,35 +626,113 @@ class TreeNode[S: Hashable, A: Hashable, M: Hashable, G: Hashable]:
         cumulative_cost: int,
         goal_utility: float,
         utility_fn: Callable[[float], float],
+        virtual_loss: int = 0,
+        outcome: int | None = None,
     ) -> None:
-        """Perform a UCB update on this node."""
-        for subgoal in result.costs:
-            k = goal_utility if result.has_goal[subgoal] else 0
-            self.Q[subgoal][action_or_method] = (
-                self.N[subgoal][action_or_method] * self.Q[subgoal][action_or_method]
-                + utility_fn(result.costs[subgoal] + cumulative_cost)
-                + k
-            ) / (1 + self.N[subgoal][action_or_method])
-            self.N[subgoal][action_or_method] += 1
-            self.visits[subgoal] += 1
-
-
-class TreePolicy[A: Hashable](ABC):
-    """A policy used to select among applicable actions at a TreeNode."""
-
-    @abstractmethod
-    def __call__(
+        """Perform a UCB update on this node.
+
+        Any `virtual_loss` added when `action_or_method` was selected is removed. If
+        `outcome` is given, `action_or_method` led to that outcome of its ChanceNode
+        (see `get_chance_node`), and its Q value is backed up as the expectation over
+        the outcomes, blended with its prior, instead of the mean of the results.
+        """
+        j = self.get_index()[action_or_method]
+        rows = self.get_rows(result.get_goal_ids())
+        utility = utility_fn(result.get_costs() + cumulative_cost)
+        goal_bonus = goal_utility * result.get_has_goal()
+        with self._lock:
+            n = self.N[rows, j]
+            if outcome is None:
+                self.Q[rows, j] = (n * self.Q[rows, j] + utility + goal_bonus) / (1 + n)
+            else:
+                self.Q[rows, j] = self._chance_nodes[action_or_method].backup(
+                    outcome, rows, utility + goal_bonus, n, self.Q[rows, j]
+                )
+            self.N[rows, j] += 1
+            self.visits[rows] += 1
+            if virtual_loss:
+                self.virtual_loss[j] -= virtual_loss
+                self.total_virtual_loss -= virtual_loss
+
+    def get_statistics(
+        self, goals: list[G], progressions: list[A | M]
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the visits, N and Q values at this node as arrays.
+
+        Rows are indexed by `goals` and columns by `progressions`. Rows which do not
+        exist yet are added, and `progressions` are seeded with their priors, so that
+        the priors are part of the returned statistics.
+        """
+        columns = self.get_columns(progressions)
+        self.seed_priors(columns)
+        rows = self.get_goal_rows(goals)
+        block = np.ix_(rows, columns)
+        return self.visits[rows].astype(float), self.N[block], self.Q[block]
+
+    def merge_statistics(
+        self,
+        goals: list[G],
+        progressions: list[A | M],
+        prior: tuple[np.ndarray, np.ndarray, np.ndarray],
+        results: list[tuple[np.ndarray, np.ndarray, np.ndarray]],
+    ) -> None:
+        """Merge the statistics of independent searches from this node into this node.
+
+        `prior` holds the statistics of this node before the searches started, and each
+        of `results` the statistics of one search when it finished (see
+        `get_statistics`). The visits and returns added by every search are summed.
+        """
+        visits, N, Q = prior
+        total_visits = visits + sum(r[0] - visits for r in results)
+        total_N = N + sum(r[1] - N for r in results)
+        total_QN = Q * N + sum(r[2] * r[1] - Q * N for r in results)
+        total_Q = np.divide(
+            total_QN, total_N, out=np.zeros_like(total_QN), where=total_N > 0
+        )
+        index = self.get_index()
+        for i, goal in enumerate(goals):
+            row = self.get_goal_row(goal)
+            if total_visits[i] > 0:
+                self.visits[row] = int(total_visits[i])
+            for j, u in enumerate(progressions):
+                if total_N[i, j] > 0:
+                    self.Q[row, index[u]] = total_Q[i, j]
+                    self.N[row, index[u]] = total_N[i, j]
+
+
+class TreeNodeAccess(NodeAccess):
+    """The NodeAccess of factored TreeNodes, which are given the progressed `gtn`."""
+
+    def get_goal_network(
+        self, node: TreeNode, gtn: CompiledGoalNetwork | None
+    ) -> CompiledGoalNetwork:
+        return gtn
+
+    def get_progressions(self, node: TreeNode, gtn: CompiledGoalNetwork) -> list:
+        return node.get_progressions(gtn)
+
+    def get_relevant_methods(
+        self, node: TreeNode, gtn: CompiledGoalNetwork
+    ) -> dict[Hashable, tuple]:
+        return node.get_relevant_methods(gtn)
+
+    def get_ranking(
         self,
         node: TreeNode,
-        gtn: PartialOrderGoalNetwork,
-        simulator: PHGNSimulator,
-        rng: np.random.RandomState | None = None,
-    ) -> A:
-        raise NotImplementedError()
+        gtn: CompiledGoalNetwork,
+        key: Hashable,
+        rank: Callable[[], np.ndarray],
+    ) -> np.ndarray:
+        return node.get_ranking(key, gtn, rank)
 
 
 class UCBPolicy[A: Hashable](TreePolicy):
-    """A TreePolicy based using the UCB1 formula."""
+    """A TreePolicy based using the UCB1 formula.
+
+    If `widening_k` is given, the policy applies progressive widening (see
+    `ProgressiveWidening`), where a node counts as visited as often as its most visited
+    unconstrained subgoal.
+    """
 
     def __init__(
         self,
@@ -165,52 +740,53 @@ class UCBPolicy[A: Hashable](TreePolicy):
         rng: np.random.RandomState | None = None,
         c: float = sqrt(2),
         normalize: bool = True,
+        widening_k: float | None = None,
+        widening_alpha: float = 0.5,
+        heuristic_policy: HeuristicPolicy | None = None,
     ):
         self.normalize = normalize
         self.c = c
-        self.simulator = simulator = simulator
+        self.simulator: PHGNSimulator = simulator
         self.rng = rng or np.random.RandomState()
+        self.widening = (
+            None
+            if widening_k is None
+            else ProgressiveWidening[A](
+                TreeNodeAccess(), widening_k, widening_alpha, heuristic_policy, self.rng
+            )
+        )
 
-    def __call__(self, node: TreeNode, gtn: PartialOrderGoalNetwork) -> A:
+    def __call__(self, node: TreeNode, gtn: CompiledGoalNetwork) -> A:
         unconstrained = gtn.get_unconstrained()
-        actions = list(node.get_applicable_actions())
-        methods = {}
-        for m in node.get_applicable_methods():
-            relevant_to = self.simulator.is_relevant(*m, gtn)
-            if relevant_to:
-                methods[m] = relevant_to
-        progressions = actions + list(methods.keys())
+        progressions = node.get_progressions(gtn)
+        methods = node.get_relevant_methods(gtn)
+        columns = node.get_columns(progressions)
+        node.seed_priors(columns)
+        rows = node.get_goal_rows(subgoal.get_content() for subgoal in unconstrained)
+        if self.widening is not None:
+            # visits of the subgoals, without the ones seeded by the priors
+            n = node.N[rows].sum(axis=1).max() - node.num_prior_visits()
+            progressions, columns = self.widening.widen(
+                node, gtn, progressions, columns, n
+            )
+        # one row per unconstrained subgoal, one column per progression
+        block = np.ix_(rows, columns)
+        q = node.Q[block]
         c = self.c
         if self.normalize:
-            c *= max(
-                sum(node.Q[subgoal.get_content()][u] for subgoal in unconstrained)
-                for u in progressions
-            )
-        vals = [
-            sum(
-                self._ucb_value(
-                    node.Q[subgoal.get_content()][u],
-                    node.N[subgoal.get_content()][u],
-                    node.visits[subgoal.get_content()],
-                    c,
-                )
-                for subgoal in unconstrained
-            )
-            for u in progressions
-        ]
-        max_val = max(vals)
-        max_progressions = [p for i, p in enumerate(progressions) if vals[i] == max_val]
-        i = self.rng.choice(len(max_progressions))
-        r = max_progressions[i]
+            c *= q.sum(axis=0).max()
+        vals = ucb_values(
+            q,
+            node.N[block],
+            node.visits[rows, np.newaxis] + node.total_virtual_loss,
+            c,
+            node.virtual_loss[columns],
+        ).sum(axis=0)
+        r = progressions[choose_max(vals, self.rng)]
         if isinstance(r[0], PHGNMethod):
-            r += tuple(methods[r])
+            r += tuple(gtn.get_unconstrained_at(methods[r]))
         return r
 
-    def _ucb_value(self, q_a: float, n_a: int, n: int, c: float) -> float:
-        if n_a == 0:
-            return np.inf
-        return q_a + c * sqrt(log(n) / n_a)
-
 
 class MaxPolicy[A: Hashable](TreePolicy):
     """A purely exploitative TreePolicy which selects the action with the maximum Q value."""
@@ -221,29 +797,21 @@ class MaxPolicy[A: Hashable](TreePolicy):
         self.simulator: PHGNSimulator = simulator
         self.rng = rng or np.random.RandomState()
 
-    def __call__(self, node: TreeNode, gtn: PartialOrderGoalNetwork) -> A:
+    def __call__(self, node: TreeNode, gtn: CompiledGoalNetwork) -> A:
         unconstrained = gtn.get_unconstrained()
-        actions = list(node.get_applicable_actions())
-        methods = {}
-        for m in node.get_applicable_methods():
-            relevant_to = self.simulator.is_relevant(*m, gtn)
-            if relevant_to:
-                methods[m] = relevant_to
-        progressions = actions + list(methods.keys())
-        print([p[0].name for p in progressions])
-        vals = [
-            sum(node.Q[subgoal.get_content()][u] for subgoal in unconstrained)
-            for u in progressions
-        ]
-        print(vals)
-        max_val = max(vals)
-        max_progressions = [p for i, p in enumerate(progressions) if vals[i] == max_val]
-        i = self.rng.choice(len(max_progressions))
-        print(len(max_progressions))
-        print(i)
-        r = max_progressions[i]
+        progressions = node.get_progressions(gtn)
+        methods = node.get_relevant_methods(gtn)
+        columns = node.get_columns(progressions)
+        rows = node.get_goal_rows(subgoal.get_content() for subgoal in unconstrained)
+        block = np.ix_(rows, columns)
+        vals = node.Q[block].sum(axis=0)
+        # progressions which were never visited only have their prior Q values
+        visited = node.N[block].sum(axis=0) > node.get_prior_visits(columns) * len(rows)
+        if visited.any():
+            vals = np.where(visited, vals, -np.inf)
+        r = progressions[choose_max(vals, self.rng)]
         if isinstance(r[0], PHGNMethod):
-            r += tuple(methods[r])
+            r += tuple(gtn.get_unconstrained_at(methods[r]))
         return r
 
 
@@ -256,47 +824,14 @@ class RobustPolicy[A: Hashable](TreePolicy):
         self.simulator: PHGNSimulator = simulator
         self.rng = rng or np.random.RandomState()
 
-    def __call__(self, node: TreeNode, gtn: PartialOrderGoalNetwork) -> A:
+    def __call__(self, node: TreeNode, gtn: CompiledGoalNetwork) -> A:
         unconstrained = gtn.get_unconstrained()
-        actions = list(node.get_applicable_actions())
-        methods = {}
-        for m in node.get_applicable_methods():
-            relevant_to = self.simulator.is_relevant(*m, gtn)
-            if relevant_to:
-                methods[m] = relevant_to
-        progressions = actions + list(methods.keys())
-        vals = [
-            sum(node.N[subgoal.get_content()][u] for subgoal in unconstrained)
-            for u in progressions
-        ]
-        max_val = max(vals)
-        max_progressions = [p for i, p in enumerate(progressions) if vals[i] == max_val]
-        i = self.rng.choice(len(max_progressions))
-        r = max_progressions[i]
-        if isinstance(r[0], PHGNMethod):
-            r += tuple(methods[r])
-        return r
-
-
-class DefaultPolicy[A: Hashable](TreePolicy):
-    """A TreePolicy which selects the action at random."""
-
-    def __init__(
-        self, simulator: PHGNSimulator, rng: np.random.RandomState | None = None
-    ) -> None:
-        self.simulator: PHGNSimulator = simulator
-        self.rng = rng or np.random.RandomState()
-
-    def __call__(self, node: TreeNode, gtn: PartialOrderGoalNetwork) -> A:
-        actions = list(node.get_applicable_actions())
-        methods = {}
-        for m in node.get_applicable_methods():
-            relevant_to = self.simulator.is_relevant(*m, gtn)
-            if relevant_to:
-                methods[m] = relevant_to
-        progressions = actions + list(methods.keys())
-        i = self.rng.choice(len(progressions))
-        r = progressions[i]
+        progressions = node.get_progressions(gtn)
+        methods = node.get_relevant_methods(gtn)
+        columns = node.get_columns(progressions)
+        rows = node.get_goal_rows(subgoal.get_content() for subgoal in unconstrained)
+        vals = node.N[np.ix_(rows, columns)].sum(axis=0)
+        r = progressions[choose_max(vals, self.rng)]
         if isinstance(r[0], PHGNMethod):
-            r += tuple(methods[r])
+            r += tuple(gtn.get_unconstrained_at(methods[r]))
         return r
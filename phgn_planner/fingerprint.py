@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import threading
+from collections.abc import Hashable, Iterable
+
+import numpy as np
+
+
+class StateFingerprinter[S, F: Hashable]:
+    """Zobrist fingerprints of states.
+
+    Every assignment of a value to a ground fluent gets a random 64-bit key, and the
+    fingerprint of a state is the XOR of the keys of its assignments. When an action
+    changes a few fluents, the fingerprint of the resulting state is obtained from the
+    one of the original state by XOR-ing out the keys of the old values and XOR-ing in
+    the keys of the new ones (see `update`).
+
+    Distinct states get the same fingerprint with probability about 2^-64, so tables
+    keyed by fingerprint must still compare the states on a hit.
+
+    Parameters
+    ----------
+    fluents : Iterable
+        The ground fluents which define a state, e.g. the keys of
+        `problem.initial_values`.
+    seed : Optional[int]
+        The seed of the random keys.
+    """
+
+    def __init__(self, fluents: Iterable[F], seed: int | None = None) -> None:
+        self._fluents: list[F] = list(fluents)
+        self._keys: dict[tuple[F, Hashable], int] = {}
+        self._rng = np.random.RandomState(seed=seed)
+        self._lock = threading.Lock()
+
+    def fingerprint(self, state: S) -> int:
+        """Return the fingerprint of `state`, computed from scratch."""
+        fingerprint = 0
+        for fluent in self._fluents:
+            fingerprint ^= self._get_key(fluent, state.get_value(fluent))
+        return fingerprint
+
+    def update(self, fingerprint: int, state: S, next_state: S) -> int:
+        """Return the fingerprint of `next_state`, a successor of `state`.
+
+        If `next_state` was made by `state.make_child`, only the fluents it assigns are
+        visited. Otherwise, the fingerprint is computed from scratch.
+        """
+        if next_state is state:
+            return fingerprint
+        if getattr(next_state, "_father", None) is not state:
+            return self.fingerprint(next_state)
+        # a child UPState stores the values it changes, and defers to its father
+        for fluent, value in next_state._values.items():
+            fingerprint ^= self._get_key(fluent, state.get_value(fluent))
+            fingerprint ^= self._get_key(fluent, value)
+        return fingerprint
+
+    def _get_key(self, fluent: F, value: Hashable) -> int:
+        key = self._keys.get((fluent, value))
+        if key is None:
+            with self._lock:
+                key = self._keys.get((fluent, value))
+                if key is None:
+                    key = int(self._rng.randint(2**64, dtype=np.uint64))
+                    self._keys[(fluent, value)] = key
+        return key
+
+
+class NogoodTable[S]:
+    """The states proven to be dead ends, keyed by fingerprint.
+
+    A state is a dead end if it has no applicable action. Once a state has been found
+    to be one, checking it again costs a lookup instead of a simulator call.
+    """
+
+    def __init__(self) -> None:
+        self._states: dict[int, S] = {}
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def add(self, fingerprint: int, state: S) -> None:
+        """Record that `state`, with the given fingerprint, is a dead end."""
+        self._states.setdefault(fingerprint, state)
+
+    def contains(self, fingerprint: int, state: S) -> bool:
+        """Whether `state`, with the given fingerprint, is a known dead end."""
+        dead_end = self._states.get(fingerprint)
+        return dead_end is not None and (dead_end is state or dead_end == state)
@@ -0,0 +1,499 @@
+from __future__ import annotations
+
+import threading
+from collections.abc import Hashable, Iterable, Iterator
+from contextlib import contextmanager
+from typing import Self
+
+import numpy as np
+from unified_planning.engines.compilers import PHGNGrounderHelper
+from unified_planning.model.phgn.goal_network import PartialOrderGoalNetwork
+from unified_planning.model.phgn.method import PHGNMethod
+
+
+class GoalInterner[G: Hashable]:
+    """Interns subgoals as dense integer IDs.
+
+    A GoalInterner is shared by every TreeNode of a TreeNodeFactory, so the statistics
+    of a subgoal are stored in the same row at every node. Subgoals are interned the
+    first time they are seen, including those created by method decomposition.
+    """
+
+    def __init__(self) -> None:
+        self._ids: dict[G, int] = {}
+        self._goals: list[G] = []
+        self._lock = threading.Lock()
+        self.generation = 0  # the number of times the interned goals were cleared
+
+    def __len__(self) -> int:
+        return len(self._goals)
+
+    def get_id(self, goal: G) -> int:
+        """Return the ID of `goal`, interning it if needed."""
+        goal_id = self._ids.get(goal)
+        if goal_id is None:
+            with self._lock:
+                goal_id = self._ids.get(goal)
+                if goal_id is None:
+                    goal_id = len(self._goals)
+                    # append first, so that every visible ID is smaller than len(self)
+                    self._goals.append(goal)
+                    self._ids[goal] = goal_id
+        return goal_id
+
+    def get_ids(self, goals: Iterable[G]) -> np.ndarray:
+        """Return the IDs of `goals`, interning any new ones."""
+        return np.array([self.get_id(goal) for goal in goals], dtype=np.intp)
+
+    def find(self, goal: G) -> int | None:
+        """Return the ID of `goal`, or None if it has not been interned."""
+        return self._ids.get(goal)
+
+    def get_goal(self, goal_id: int) -> G:
+        return self._goals[goal_id]
+
+    def clear(self) -> None:
+        """Forget every interned goal, whose IDs must then no longer be used.
+
+        The IDs interned before are told apart by the incremented `generation`.
+        """
+        with self._lock:
+            self._ids = {}
+            self._goals = []
+            self.generation += 1
+
+
+class GoalNode[G: Hashable]:
+    """A node of a CompiledGoalNetwork, holding one subgoal."""
+
+    __slots__ = ("index", "goal_id", "_content")
+
+    def __init__(self, index: int, goal_id: int, content: G) -> None:
+        self.index: int = index  # position of this node in its network
+        self.goal_id: int = goal_id  # ID of the subgoal (see GoalInterner)
+        self._content: G = content
+
+    def __repr__(self) -> str:
+        return f"GoalNode({self._content})"
+
+    def get_content(self) -> G:
+        return self._content
+
+
+class CompiledGoalNetwork[G: Hashable]:
+    """A partial-order goal network compiled for fast progression.
+
+    Nodes are numbered in the order they are added to the network. The predecessors
+    and successors of each node, the nodes which have not been released and the
+    unconstrained frontier are all stored as bitmasks over these numbers, and are
+    updated incrementally by `release` and `decompose`, and released nodes are only
+    dropped by `compact`. Copies share the GoalNodes, so a node of a network can be
+    passed to any of its copies, until either is compacted. A copy also shares the
+    lists of nodes and bitmasks with the original until either of them is modified,
+    so that copies which are never modified take constant time.
+
+    Two networks are equal if they have the same `canonical_key`, i.e. if they hold
+    the same subgoals under the same ordering constraints, however their nodes are
+    numbered.
+
+    Parameters
+    ----------
+    nodes : list[GoalNode]
+        The nodes of the network, where `nodes[i].index == i`.
+    preds : list[int]
+        The bitmask of the predecessors of each node.
+    succs : list[int]
+        The bitmask of the successors of each node.
+    signatures : Optional[GoalInterner]
+        The interned signatures used by `canonical_key`, which must be shared by every
+        network compared with this one. If None, a new GoalInterner is created.
+    """
+
+    __slots__ = (
+        "_nodes",
+        "_preds",
+        "_succs",
+        "_shared",
+        "_remaining",
+        "_unconstrained",
+        "_signatures",
+        "_journal",
+        "_canonical",
+        "_generation",
+        "_frontier",
+        "_hash",
+    )
+
+    def __init__(
+        self,
+        nodes: list[GoalNode[G]],
+        preds: list[int],
+        succs: list[int],
+        signatures: GoalInterner[tuple] | None = None,
+    ) -> None:
+        self._nodes = nodes
+        self._preds = preds
+        self._succs = succs
+        self._shared = False  # whether the lists are shared with a copy
+        self._remaining = (1 << len(nodes)) - 1
+        self._unconstrained = sum(1 << i for i, mask in enumerate(preds) if not mask)
+        self._signatures = GoalInterner[tuple]() if signatures is None else signatures
+        self._journal: list[tuple] | None = None
+        self._canonical: tuple | None = None
+        self._generation = 0  # the generation of the signatures of _canonical
+        self._frontier: tuple | None = None
+        self._hash: int | None = None
+
+    def __eq__(self, other: object) -> bool:
+        return self is other or (
+            isinstance(other, CompiledGoalNetwork)
+            and hash(self) == hash(other)
+            and self.canonical_key() == other.canonical_key()
+        )
+
+    def __hash__(self) -> int:
+        if self._hash is None or self._generation != self._signatures.generation:
+            self._hash = hash(self.canonical_key())
+        return self._hash
+
+    def __str__(self) -> str:
+        edges = [
+            f"{self._nodes[i].get_content()} -> {self._nodes[j].get_content()}"
+            for i in _bits(self._remaining)
+            for j in _bits(self._succs[i] & self._remaining)
+        ]
+        return f"Nodes: {self.get_nodes()}, Edges: {edges}"
+
+    def is_empty(self) -> bool:
+        return not self._remaining
+
+    def get_nodes(self) -> list[GoalNode[G]]:
+        """Return the nodes which have not been released."""
+        return [self._nodes[i] for i in _bits(self._remaining)]
+
+    def get_goal_ids(self) -> np.ndarray:
+        """Return the subgoal IDs of the nodes which have not been released."""
+        return np.array(
+            [self._nodes[i].goal_id for i in _bits(self._remaining)], dtype=np.intp
+        )
+
+    def get_unconstrained(self) -> list[GoalNode[G]]:
+        """Return the nodes without unreleased predecessors, in order."""
+        return [self._nodes[i] for i in _bits(self._unconstrained)]
+
+    def get_unconstrained_at(self, positions: Iterable[int]) -> list[GoalNode[G]]:
+        """Return the nodes at `positions` in `get_unconstrained()`."""
+        unconstrained = self.get_unconstrained()
+        return [unconstrained[i] for i in positions]
+
+    def get_successors(self, node: GoalNode[G]) -> list[GoalNode[G]]:
+        """Return the unreleased successors of `node`."""
+        successors = self._succs[node.index] & self._remaining
+        return [self._nodes[j] for j in _bits(successors)]
+
+    def canonical_key(self) -> tuple:
+        """Return a key identifying this network up to the numbering of its nodes.
+
+        Each remaining node is labelled with the interned signature of its subgoal and
+        of the labels of its predecessors, so structurally identical networks get the
+        same labels whichever order they were decomposed in. The key lists the label
+        and the predecessors of each node, after renumbering the nodes by label. It is
+        computed once, until the network is modified or the signatures are reset (see
+        `GoalNetworkCompiler.reset_signatures`).
+        """
+        generation = self._signatures.generation
+        if self._canonical is None or self._generation != generation:
+            remaining = self._remaining
+            labels: dict[int, int] = {}
+            pending = remaining
+            while pending:
+                # label the nodes whose predecessors are all labelled
+                ready = [i for i in _bits(pending) if not self._preds[i] & pending]
+                for i in ready:
+                    pred_labels = sorted(
+                        labels[p] for p in _bits(self._preds[i] & remaining)
+                    )
+                    labels[i] = self._signatures.get_id(
+                        (self._nodes[i].goal_id, tuple(pred_labels))
+                    )
+                    pending &= ~(1 << i)
+            order = sorted(labels, key=labels.__getitem__)
+            rank = {i: r for r, i in enumerate(order)}
+            self._canonical = tuple(
+                (
+                    labels[i],
+                    sum(1 << rank[p] for p in _bits(self._preds[i] & remaining)),
+                )
+                for i in order
+            )
+            self._generation = generation
+        return self._canonical
+
+    def frontier_key(self) -> tuple[int, ...]:
+        """Return a key identifying the unconstrained nodes of this network.
+
+        The key holds the subgoal IDs of the unconstrained nodes, in order, so the
+        relevance of a method computed for one network (see
+        `GoalNetworkCompiler.get_relevance`) holds for every network with the same key.
+        """
+        if self._frontier is None:
+            self._frontier = tuple(
+                self._nodes[i].goal_id for i in _bits(self._unconstrained)
+            )
+        return self._frontier
+
+    def copy(self) -> CompiledGoalNetwork[G]:
+        gtn = object.__new__(type(self))
+        gtn._nodes = self._nodes
+        gtn._preds = self._preds
+        gtn._succs = self._succs
+        gtn._shared = self._shared = True
+        gtn._remaining = self._remaining
+        gtn._unconstrained = self._unconstrained
+        gtn._signatures = self._signatures
+        gtn._journal = None
+        gtn._canonical = self._canonical
+        gtn._generation = self._generation
+        gtn._frontier = self._frontier
+        gtn._hash = self._hash
+        return gtn
+
+    def release(self, node: GoalNode[G]) -> Self:
+        """Release `node`, which then no longer constrains its successors."""
+        bit = 1 << node.index
+        if not self._remaining & bit:
+            return self
+        successors = self._succs[node.index] & self._remaining
+        self._record(successors)
+        if successors:
+            self._unshare()
+        self._remaining &= ~bit
+        self._unconstrained &= ~bit
+        for j in _bits(successors):
+            self._preds[j] &= ~bit
+            if not self._preds[j]:
+                self._unconstrained |= 1 << j
+        self._canonical = self._frontier = self._hash = None
+        return self
+
+    def decompose(
+        self, method_gtn: CompiledGoalNetwork[G], *relevant: GoalNode[G]
+    ) -> Self:
+        """Add the nodes of `method_gtn` to this network, before the `relevant` nodes.
+
+        Every node of `method_gtn` without successors becomes a predecessor of each of
+        the `relevant` nodes. `method_gtn` itself is not modified.
+        """
+        relevant_mask = 0
+        for node in relevant:
+            relevant_mask |= 1 << node.index
+        self._record(relevant_mask)
+        self._unshare()
+        offset = len(self._nodes)
+        remaining = method_gtn._remaining
+        sinks = 0
+        for i in _bits(remaining):
+            if not method_gtn._succs[i] & remaining:
+                sinks |= 1 << (offset + i)
+        for node, preds, succs in zip(
+            method_gtn._nodes, method_gtn._preds, method_gtn._succs
+        ):
+            self._nodes.append(
+                GoalNode(offset + node.index, node.goal_id, node.get_content())
+            )
+            self._preds.append(preds << offset)
+            self._succs.append(succs << offset)
+        for i in _bits(sinks):
+            self._succs[i] |= relevant_mask
+        if sinks:
+            for j in _bits(relevant_mask):
+                self._preds[j] |= sinks
+            self._unconstrained &= ~relevant_mask
+        self._remaining |= remaining << offset
+        self._unconstrained |= method_gtn._unconstrained << offset
+        self._canonical = self._frontier = self._hash = None
+        return self
+
+    def compact(self) -> Self:
+        """Drop the released nodes, and renumber the remaining ones in order.
+
+        The remaining nodes are replaced by new GoalNodes, so the nodes obtained from
+        this network before can no longer be passed to it. The keys of the network
+        are unchanged. Must not be called while the network is journaled.
+        """
+        if self._remaining == (1 << len(self._nodes)) - 1:
+            return self
+        remaining = list(_bits(self._remaining))
+        rank = {i: r for r, i in enumerate(remaining)}
+
+        def renumber(mask: int) -> int:
+            return sum(1 << rank[j] for j in _bits(mask & self._remaining))
+
+        nodes = [
+            GoalNode(r, self._nodes[i].goal_id, self._nodes[i].get_content())
+            for r, i in enumerate(remaining)
+        ]
+        preds = [renumber(self._preds[i]) for i in remaining]
+        succs = [renumber(self._succs[i]) for i in remaining]
+        self._nodes, self._preds, self._succs = nodes, preds, succs
+        self._shared = False
+        self._unconstrained = renumber(self._unconstrained)
+        self._remaining = (1 << len(nodes)) - 1
+        return self
+
+    @contextmanager
+    def journaled(self) -> Iterator[Self]:
+        """Record the modifications of this network, and undo them on exit.
+
+        A rollout can then modify a single shared network instead of a copy.
+        """
+        self._journal = []
+        try:
+            yield self
+        finally:
+            journal, self._journal = self._journal, None
+            if journal:
+                self._unshare()
+            while journal:
+                remaining, unconstrained, num_nodes, preds = journal.pop()
+                del self._nodes[num_nodes:]
+                del self._preds[num_nodes:]
+                del self._succs[num_nodes:]
+                for j, mask in preds:
+                    self._preds[j] = mask
+                self._remaining = remaining
+                self._unconstrained = unconstrained
+            self._canonical = self._frontier = self._hash = None
+
+    def _unshare(self) -> None:
+        # copy the lists before modifying them, if they are shared with a copy
+        if self._shared:
+            self._nodes = self._nodes.copy()
+            self._preds = self._preds.copy()
+            self._succs = self._succs.copy()
+            self._shared = False
+
+    def _record(self, changed_preds: int) -> None:
+        # journal the state a modification changes, where changed_preds is the bitmask
+        # of the nodes whose predecessors it changes
+        if self._journal is not None:
+            self._journal.append(
+                (
+                    self._remaining,
+                    self._unconstrained,
+                    len(self._nodes),
+                    [(j, self._preds[j]) for j in _bits(changed_preds)],
+                )
+            )
+
+
+class GoalNetworkCompiler[G: Hashable]:
+    """Compiles the goal networks of a PHGNProblem into CompiledGoalNetworks.
+
+    The compiler also decides which grounded methods are relevant to a network (see
+    `get_relevance`), in place of `PHGNSimulator.is_relevant`, which only accepts a
+    PartialOrderGoalNetwork.
+
+    Parameters
+    ----------
+    grounder : PHGNGrounderHelper
+        The grounder of the methods whose goal networks are compiled.
+    goals : Optional[GoalInterner]
+        The interned subgoals of the compiled networks. If None, a new GoalInterner
+        is created.
+    """
+
+    def __init__(
+        self, grounder: PHGNGrounderHelper, goals: GoalInterner[G] | None = None
+    ) -> None:
+        self._grounder = grounder
+        self.goals: GoalInterner[G] = GoalInterner[G]() if goals is None else goals
+        self._signatures = GoalInterner[tuple]()
+        self._method_networks: dict[tuple, CompiledGoalNetwork[G]] = {}
+        self._postconditions: dict[tuple, frozenset[int]] = {}
+
+    def compile(self, gtn: PartialOrderGoalNetwork) -> CompiledGoalNetwork[G]:
+        """Compile `gtn`, e.g. the goal network of a problem."""
+        nodes = list(gtn.network)
+        index = {node: i for i, node in enumerate(nodes)}
+        return CompiledGoalNetwork[G](
+            [
+                GoalNode(i, self.goals.get_id(node.get_content()), node.get_content())
+                for i, node in enumerate(nodes)
+            ],
+            [
+                sum(1 << index[p] for p in gtn.network.predecessors(node))
+                for node in nodes
+            ],
+            [
+                sum(1 << index[s] for s in gtn.network.successors(node))
+                for node in nodes
+            ],
+            self._signatures,
+        )
+
+    def compile_method(
+        self, method: PHGNMethod, params: tuple
+    ) -> CompiledGoalNetwork[G]:
+        """Return the compiled goal network of `method` grounded with `params`.
+
+        Compiled method networks are cached, and must not be modified.
+        """
+        key = (method, params)
+        gtn = self._method_networks.get(key)
+        if gtn is None:
+            method_gtn = self._grounder.ground_method(method, params).goal_network
+            gtn = self._method_networks[key] = self.compile(method_gtn)
+        return gtn
+
+    def reset_signatures(self) -> None:
+        """Forget the signatures interned by the canonical keys of compiled networks.
+
+        Signatures are interned for every network whose canonical key is computed, so
+        they should be reset once most of those networks have been freed. The keys
+        computed before, including those of networks still in use, are recomputed when
+        next needed, since they belong to an older `generation` of the signatures.
+        """
+        self._signatures.clear()
+
+    def get_relevance(
+        self, method: PHGNMethod, params: tuple, frontier: tuple[int, ...]
+    ) -> tuple[int, ...]:
+        """Return the positions of the subgoals in `frontier` which `method` achieves.
+
+        `frontier` is the `frontier_key` of a goal network. As for
+        `PHGNSimulator.is_relevant`, the method grounded with `params` is relevant to
+        the unconstrained subgoals which are among its postconditions.
+        """
+        key = (method, params)
+        postconditions = self._postconditions.get(key)
+        if postconditions is None:
+            grounded = self._grounder.ground_method(method, params)
+            postconditions = self._postconditions[key] = frozenset(
+                self.goals.get_id(p) for p in grounded.postconditions
+            )
+        return tuple(i for i, goal in enumerate(frontier) if goal in postconditions)
+
+    def get_relevant_methods(
+        self, methods: Iterable[tuple], gtn: CompiledGoalNetwork[G]
+    ) -> dict[tuple, tuple[int, ...]]:
+        """Map the `methods` relevant to `gtn` to the positions they are relevant to.
+
+        Each method is a (method, params) pair, and the positions are those of its
+        unconstrained nodes (see `get_unconstrained_at`).
+        """
+        frontier = gtn.frontier_key()
+        relevant = {}
+        for m in methods:
+            positions = self.get_relevance(*m, frontier)
+            if positions:
+                relevant[m] = positions
+        return relevant
+
+
+def _bits(mask: int) -> Iterator[int]:
+    # the positions of the set bits of mask, in increasing order
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
@@ -0,0 +1,447 @@
+from __future__ import annotations
+
+import heapq
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable
+from math import exp, inf
+
+from unified_planning.engines.compilers import PHGNGrounderHelper
+from unified_planning.model.action import ProbabilisticAction
+from unified_planning.model.fnode import FNode
+from unified_planning.model.phgn.phgn_problem import PHGNProblem
+from phgn_planner.fingerprint import StateFingerprinter
+
+
+class RelaxedTask:
+    """The delete relaxation of the all-outcomes determinization of a PHGNProblem.
+
+    Facts are assignments of values to ground fluents, numbered in the order they are
+    encountered. Every outcome of every ground action becomes a relaxed action, which
+    reaches the facts assigned by its effects once all of its precondition facts are
+    reached, and never deletes any. Conditions which are not conjunctions of facts,
+    such as disjunctions or numeric comparisons, are dropped, which only makes the
+    relaxation more optimistic.
+
+    Parameters
+    ----------
+    problem : PHGNProblem
+        The problem to relax.
+    grounder : Optional[PHGNGrounderHelper]
+        The grounder of the actions of `problem`. If None, a new one is created.
+    """
+
+    def __init__(
+        self, problem: PHGNProblem, grounder: PHGNGrounderHelper | None = None
+    ) -> None:
+        grounder = PHGNGrounderHelper(problem) if grounder is None else grounder
+        expression_manager = problem.environment.expression_manager
+        self._true: FNode = expression_manager.TRUE()
+        self._false: FNode = expression_manager.FALSE()
+        self._facts: dict[FNode, dict[FNode, int]] = {}
+        self._conditions: dict[FNode, tuple[int, ...] | None] = {}
+        self._consumers: list[list[int]] = []
+        self._lock = threading.Lock()
+        self.preconditions: list[tuple[int, ...]] = []
+        self.effects: list[tuple[int, ...]] = []
+        # the (action, parameters) of the ground action of each relaxed action
+        self.labels: list[tuple] = []
+        for action, params, ground_action in grounder.get_grounded_actions():
+            if ground_action is not None:
+                self._add_action((action, params), ground_action)
+        for a, precondition in enumerate(self.preconditions):
+            for f in precondition:
+                self._consumers[f].append(a)
+        self._achievers: dict[int, set[tuple]] = {}
+        for a, effects in enumerate(self.effects):
+            for f in effects:
+                self._achievers.setdefault(f, set()).add(self.labels[a])
+        self._relaxed_actions: dict[tuple, list[int]] = {}
+        for a, label in enumerate(self.labels):
+            self._relaxed_actions.setdefault(label, []).append(a)
+        self._free_actions = [a for a, pre in enumerate(self.preconditions) if not pre]
+
+    def num_facts(self) -> int:
+        return len(self._consumers)
+
+    def get_fact(self, fluent: FNode, value: FNode) -> int:
+        """Return the number of the fact that `fluent` has `value`, adding it if new."""
+        fact = self._facts.get(fluent, {}).get(value)
+        if fact is None:
+            with self._lock:
+                values = self._facts.setdefault(fluent, {})
+                fact = values.get(value)
+                if fact is None:
+                    fact = values[value] = len(self._consumers)
+                    self._consumers.append([])
+        return fact
+
+    def get_condition_facts(
+        self, conditions: Iterable[FNode]
+    ) -> tuple[int, ...] | None:
+        """Return the facts of the conjunction of `conditions`, or None if it is False.
+
+        The facts of every condition are cached.
+        """
+        facts = set()
+        for condition in conditions:
+            if condition not in self._conditions:
+                self._conditions[condition] = self._parse_condition(condition)
+            condition_facts = self._conditions[condition]
+            if condition_facts is None:
+                return None
+            facts.update(condition_facts)
+        return tuple(sorted(facts))
+
+    def get_achievers(self, facts: Iterable[int]) -> set[tuple]:
+        """Return the labels of the ground actions which reach any of `facts`."""
+        achievers = set()
+        for f in facts:
+            achievers.update(self._achievers.get(f, ()))
+        return achievers
+
+    def get_relaxed_successor(
+        self, state_facts: Iterable[int], label: tuple
+    ) -> list[int]:
+        """Return the facts which hold after the ground action `label` is relaxed.
+
+        These are `state_facts` and the facts reached by the relaxed actions of `label`
+        whose preconditions hold in `state_facts`, i.e. by all of its outcomes.
+        """
+        facts = set(state_facts)
+        reached = [
+            self.effects[a]
+            for a in self._relaxed_actions.get(label, ())
+            if facts.issuperset(self.preconditions[a])
+        ]
+        facts.update(*reached)
+        return list(facts)
+
+    def get_state_facts(self, state) -> list[int]:
+        """Return the facts which hold in `state`."""
+        facts = []
+        for fluent, values in list(self._facts.items()):
+            fact = values.get(state.get_value(fluent))
+            if fact is not None:
+                facts.append(fact)
+        return facts
+
+    def explore(
+        self, state_facts: Iterable[int], goals: Iterable[int], additive: bool
+    ) -> tuple[list[float], list[int]]:
+        """Compute the cost of reaching every fact from `state_facts`.
+
+        The cost of a relaxed action is one plus the sum (hadd) or the maximum (hmax)
+        of the costs of its preconditions. Returns the cost of each fact, inf if it is
+        not reached, and the cheapest relaxed action reaching it (-1 for the facts of
+        the state and the unreached ones). The exploration stops once every fact of
+        `goals` is reached, so the costs of more expensive facts may be too high.
+        """
+        cost = [inf] * self.num_facts()
+        supporter = [-1] * len(cost)
+        remaining = [len(precondition) for precondition in self.preconditions]
+        value = [0.0] * len(remaining)
+        heap = []
+        for f in state_facts:
+            cost[f] = 0
+            heap.append((0, f))
+        for a in self._free_actions:
+            for g in self.effects[a]:
+                if 1 < cost[g]:
+                    cost[g] = 1
+                    supporter[g] = a
+                    heap.append((1, g))
+        heapq.heapify(heap)
+        pending = set(goals)
+        while heap and pending:
+            c, f = heapq.heappop(heap)
+            if c > cost[f]:
+                continue
+            pending.discard(f)
+            for a in self._consumers[f]:
+                value[a] = value[a] + c if additive else max(value[a], c)
+                remaining[a] -= 1
+                if remaining[a] == 0:
+                    action_cost = value[a] + 1
+                    for g in self.effects[a]:
+                        if action_cost < cost[g]:
+                            cost[g] = action_cost
+                            supporter[g] = a
+                            heapq.heappush(heap, (action_cost, g))
+        return cost, supporter
+
+    def _add_action(self, label: tuple, action) -> None:
+        precondition = self.get_condition_facts(action.preconditions)
+        if precondition is None:
+            return
+        for effects in _outcome_effects(action):
+            reached = set()
+            for effect in effects:
+                if not effect.is_assignment() or not effect.value.is_constant():
+                    continue
+                fact = self.get_fact(effect.fluent, effect.value)
+                if not effect.is_conditional():
+                    reached.add(fact)
+                    continue
+                # a conditional effect is a relaxed action of its own
+                condition = self.get_condition_facts([effect.condition])
+                if condition is not None:
+                    self._add_relaxed_action(
+                        label, set(precondition) | set(condition), {fact}
+                    )
+            if reached:
+                self._add_relaxed_action(label, set(precondition), reached)
+
+    def _add_relaxed_action(
+        self, label: tuple, precondition: set[int], effects: set[int]
+    ) -> None:
+        self.preconditions.append(tuple(sorted(precondition)))
+        self.effects.append(tuple(sorted(effects - precondition)))
+        self.labels.append(label)
+
+    def _parse_condition(self, condition: FNode) -> tuple[int, ...] | None:
+        # the facts of a conjunction of literals; other conditions are dropped
+        facts = []
+        stack = [condition]
+        while stack:
+            c = stack.pop()
+            if c.is_and():
+                stack.extend(c.args)
+            elif c.is_fluent_exp():
+                facts.append(self.get_fact(c, self._true))
+            elif c.is_not() and c.arg(0).is_fluent_exp():
+                facts.append(self.get_fact(c.arg(0), self._false))
+            elif c.is_equals() and c.arg(0).is_fluent_exp() and c.arg(1).is_constant():
+                facts.append(self.get_fact(c.arg(0), c.arg(1)))
+            elif c.is_equals() and c.arg(1).is_fluent_exp() and c.arg(0).is_constant():
+                facts.append(self.get_fact(c.arg(1), c.arg(0)))
+            elif c.is_false():
+                return None
+        return tuple(sorted(set(facts)))
+
+
+def _outcome_effects(action) -> list[list]:
+    # the all-outcomes determinization: the effects of every outcome of `action`. A
+    # ProbabilisticAction maps the names of its outcomes to their probabilities, and
+    # stores their effects by name, as built by add_outcome(name, probability) and
+    # add_effect(name, fluent, value); OutcomeEnumerator relies on the same API
+    if isinstance(action, ProbabilisticAction):
+        return [action.effects[outcome] for outcome in action.outcomes]
+    return [action.effects]
+
+
+class Heuristic[S](ABC):
+    """A domain-independent estimate of the cost of achieving goals from a state.
+
+    Estimates are memoized by the fingerprint of the state and the goals. The
+    fingerprint of a state made by `make_child` from a recently evaluated state is
+    updated from the fingerprint of its father (see `StateFingerprinter.update`), but
+    an estimate which is not memoized explores the relaxation from scratch.
+    Calling a Heuristic estimates the cost of its default goals, and `utility` and
+    `goal_probability` turn it into the h_util and h_ptg of a UCTConfig.
+
+    Parameters
+    ----------
+    problem : PHGNProblem
+        The problem whose states are evaluated.
+    task : Optional[RelaxedTask]
+        The relaxation of `problem`, which may be shared between heuristics. If None, a
+        new one is built.
+    goals : Optional[Iterable[FNode]]
+        The default goals. If None, the subgoals of the goal network of `problem`.
+    seed : Optional[int]
+        The seed of the fingerprints, if they are not given.
+    fingerprints : Optional[StateFingerprinter]
+        The fingerprints of the states, e.g. those of the planner, so that the random
+        keys of the fluents are shared. If None, new ones are created.
+    max_memo : int
+        The maximum number of memoized estimates, of states and of relaxed successors
+        each. Once exceeded, the memo is cleared.
+    """
+
+    def __init__(
+        self,
+        problem: PHGNProblem,
+        task: RelaxedTask | None = None,
+        goals: Iterable[FNode] | None = None,
+        seed: int | None = None,
+        fingerprints: StateFingerprinter[S, FNode] | None = None,
+        max_memo: int = 100_000,
+    ) -> None:
+        self.task: RelaxedTask = RelaxedTask(problem) if task is None else task
+        if goals is None:
+            goals = [node.get_content() for node in problem.goal_network.network]
+        self.goal_facts: tuple[int, ...] | None = self.task.get_condition_facts(goals)
+        self.max_memo = max_memo
+        self._fingerprints: StateFingerprinter[S, FNode] = (
+            StateFingerprinter[S, FNode](problem.initial_values, seed)
+            if fingerprints is None
+            else fingerprints
+        )
+        self._recent: dict[int, tuple[S, int]] = {}
+        self._memo: dict[tuple[int, tuple[int, ...] | None], tuple[S, float]] = {}
+        self._successor_memo: dict[
+            tuple[int, tuple, tuple[int, ...]], tuple[S, float]
+        ] = {}
+
+    def __call__(self, state: S) -> float:
+        """Estimate the cost of achieving the default goals from `state`."""
+        return self._estimate(state, self.goal_facts, None)
+
+    def estimate(
+        self, state: S, goals: Iterable[FNode], fingerprint: int | None = None
+    ) -> float:
+        """Estimate the cost of achieving all of `goals` from `state`.
+
+        `fingerprint` is the fingerprint of `state` under this Heuristic, which is
+        computed if None.
+        """
+        return self._estimate(state, self.task.get_condition_facts(goals), fingerprint)
+
+    def estimate_successors(
+        self, state: S, labels: Iterable[tuple], goals: Iterable[FNode]
+    ) -> list[float]:
+        """Estimate the cost of achieving all of `goals` after each action of `labels`.
+
+        The actions are not applied: each estimate is that of the relaxed successor of
+        `state` (see `RelaxedTask.get_relaxed_successor`). Estimates are memoized by
+        the fingerprint of `state`, the action and the goals, and the relaxation is
+        only explored for the successors which reach a fact `state` does not hold.
+        """
+        goal_facts = self.task.get_condition_facts(goals)
+        if goal_facts is None:  # the goals are contradictory
+            return [inf for _ in labels]
+        fingerprint = self.fingerprint(state)
+        state_facts = None
+        estimates = []
+        for label in labels:
+            key = (fingerprint, label, goal_facts)
+            memo = self._successor_memo.get(key)
+            if memo is not None and (memo[0] is state or memo[0] == state):
+                estimates.append(memo[1])
+                continue
+            if state_facts is None:
+                state_facts = self.task.get_state_facts(state)
+            facts = self.task.get_relaxed_successor(state_facts, label)
+            if len(facts) == len(state_facts):
+                h = self._estimate(state, goal_facts, fingerprint)
+            else:
+                h = self._evaluate(facts, goal_facts)
+            if len(self._successor_memo) >= self.max_memo:
+                self._successor_memo.clear()
+            self._successor_memo[key] = (state, h)
+            estimates.append(h)
+        return estimates
+
+    def fingerprint(self, state: S) -> int:
+        """Return the fingerprint of `state` under this Heuristic."""
+        father = getattr(state, "_father", None)
+        recent = self._recent.get(id(father)) if father is not None else None
+        if recent is not None and recent[0] is father:
+            fingerprint = self._fingerprints.update(recent[1], father, state)
+        else:
+            fingerprint = self._fingerprints.fingerprint(state)
+        if len(self._recent) >= 1024:
+            self._recent.clear()
+        self._recent[id(state)] = (state, fingerprint)
+        return fingerprint
+
+    def utility(self, risk_factor: float = -0.1) -> Callable[[S], float]:
+        """Return the utility exp(risk_factor * h) of the estimates h, as an h_util."""
+
+        def h_util(state: S) -> float:
+            h = self(state)
+            return 0.0 if h == inf else exp(risk_factor * h)
+
+        return h_util
+
+    def goal_probability(self) -> Callable[[S], float]:
+        """Return an h_ptg which is 0 where the goals are unreachable, 1 elsewhere."""
+        return lambda state: 0.0 if self(state) == inf else 1.0
+
+    def _estimate(
+        self, state: S, goals: tuple[int, ...] | None, fingerprint: int | None
+    ) -> float:
+        if goals is None:  # the goals are contradictory
+            return inf
+        if fingerprint is None:
+            fingerprint = self.fingerprint(state)
+        memo = self._memo.get((fingerprint, goals))
+        if memo is not None and (memo[0] is state or memo[0] == state):
+            return memo[1]
+        h = self._evaluate(self.task.get_state_facts(state), goals)
+        if len(self._memo) >= self.max_memo:
+            self._memo.clear()
+        self._memo[(fingerprint, goals)] = (state, h)
+        return h
+
+    @abstractmethod
+    def _evaluate(self, state_facts: list[int], goals: tuple[int, ...]) -> float:
+        raise NotImplementedError()
+
+
+class GoalCountHeuristic[S](Heuristic[S]):
+    """The number of goal facts which do not hold in the state."""
+
+    def _evaluate(self, state_facts: list[int], goals: tuple[int, ...]) -> float:
+        return len(set(goals).difference(state_facts))
+
+
+class HMaxHeuristic[S](Heuristic[S]):
+    """The hmax heuristic: the cost of the most expensive goal fact in the relaxation.
+
+    hmax never overestimates the cost of achieving the goals.
+    """
+
+    def _evaluate(self, state_facts: list[int], goals: tuple[int, ...]) -> float:
+        cost, _ = self.task.explore(state_facts, goals, additive=False)
+        return max((cost[g] for g in goals), default=0)
+
+
+class HAddHeuristic[S](Heuristic[S]):
+    """The hadd heuristic: the sum of the costs of the goal facts in the relaxation."""
+
+    def _evaluate(self, state_facts: list[int], goals: tuple[int, ...]) -> float:
+        cost, _ = self.task.explore(state_facts, goals, additive=True)
+        return sum(cost[g] for g in goals)
+
+
+class FFHeuristic[S](Heuristic[S]):
+    """The FF heuristic: the length of a relaxed plan for the goal facts.
+
+    The relaxed plan is extracted backwards from the goals along the cheapest relaxed
+    actions found by the hadd exploration.
+    """
+
+    def _evaluate(self, state_facts: list[int], goals: tuple[int, ...]) -> float:
+        plan = self._get_relaxed_plan(state_facts, goals)
+        return inf if plan is None else len(plan)
+
+    def _get_relaxed_plan(
+        self, state_facts: list[int], goals: tuple[int, ...]
+    ) -> set[int] | None:
+        # the relaxed actions of a relaxed plan, or None if a goal is unreachable
+        cost, supporter = self.task.explore(state_facts, goals, additive=True)
+        if any(cost[g] == inf for g in goals):
+            return None
+        plan = set()
+        reached = set()
+        stack = list(goals)
+        while stack:
+            f = stack.pop()
+            if f in reached:
+                continue
+            reached.add(f)
+            a = supporter[f]
+            if a >= 0 and a not in plan:
+                plan.add(a)
+                stack.extend(self.task.preconditions[a])
+        return plan
+
+
+HEURISTICS: dict[str, type[Heuristic]] = {
+    "goal_count": GoalCountHeuristic,
+    "hmax": HMaxHeuristic,
+    "hadd": HAddHeuristic,
+    "ff": FFHeuristic,
+}
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import multiprocessing
+from collections.abc import Callable
+from typing import Any
+
+# The search task run by forked workers. It is set by `run_root_parallel` right before
+# the worker processes are forked, so workers inherit the planner, the search tree and
+# the current goal network without pickling any unified-planning objects.
+_TASK: Callable[[int, int | None], Any] | None = None
+
+
+def split_rollouts(n_rollouts: int | None, n_workers: int) -> list[int | None]:
+    """Split `n_rollouts` as evenly as possible across `n_workers`.
+
+    If `n_rollouts` is None (the search is time-limited), each worker gets None.
+    """
+    if n_rollouts is None:
+        return [None] * n_workers
+    share, remainder = divmod(n_rollouts, n_workers)
+    return [share + (1 if i < remainder else 0) for i in range(n_workers)]
+
+
+def run_root_parallel(
+    task: Callable[[int, int | None], Any],
+    seeds: list[int],
+    shares: list[int | None],
+) -> list[Any]:
+    """Run `task(seed, n_rollouts)` once per worker in forked processes.
+
+    Parameters
+    ----------
+    task : Callable[[int, int], Any]
+        The search to run in each worker. It receives the worker's seed and its share
+        of the rollouts, and must return a picklable summary of the worker's root
+        statistics.
+    seeds : list[int]
+        One seed per worker, used to give each worker an independent RNG stream.
+    shares : list[int | None]
+        The number of rollouts to perform in each worker, or None to search until the
+        task's deadline.
+
+    Returns
+    -------
+    list[Any]
+        The results of `task`, in worker order.
+    """
+    global _TASK
+    _TASK = task
+    try:
+        with multiprocessing.get_context("fork").Pool(len(seeds)) as pool:
+            return pool.starmap(_run_task, zip(seeds, shares))
+    finally:
+        _TASK = None
+
+
+def _run_task(seed: int, n_rollouts: int | None) -> Any:
+    return _TASK(seed, n_rollouts)
@@ -0,0 +1,452 @@
+from __future__ import annotations
+
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from math import inf
+from typing import TYPE_CHECKING
+
+import numpy as np
+from unified_planning.engines.phgn_simulator import PHGNSimulator
+from unified_planning.model.phgn import PHGNMethod
+from phgn_planner.heuristics import Heuristic, RelaxedTask
+from phgn_planner.goal_network import CompiledGoalNetwork
+
+
+if TYPE_CHECKING:
+    from phgn_planner import factored_tree, unfactored_tree
+
+    type TreeNode = factored_tree.TreeNode | unfactored_tree.TreeNode
+
+
+ROLLOUT_POLICIES = ("random", "helpful", "epsilon_greedy", "boltzmann")
+
+# the number of goal sets whose achievers a HelpfulActionPolicy caches
+_MAX_ACHIEVER_SETS = 64
+
+
+def ucb_values(
+    q: np.ndarray,
+    n_a: np.ndarray,
+    n: int | np.ndarray,
+    c: float,
+    virtual_loss: np.ndarray | None = None,
+) -> np.ndarray:
+    """Compute the UCB1 value of each progression from its Q value and visit count.
+
+    `n` is the visit count of the node, and may be broadcast against `q`. Pending
+    `virtual_loss` counts as visits which earned no utility. Progressions which have
+    not been visited get an infinite value.
+    """
+    if virtual_loss is not None and virtual_loss.any():
+        q = np.divide(q * n_a, n_a + virtual_loss, out=np.zeros_like(q), where=n_a > 0)
+        n_a = n_a + virtual_loss
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vals = q + c * np.sqrt(np.log(n) / n_a)
+    return np.where(n_a == 0, np.inf, vals)
+
+
+def choose_max(vals: np.ndarray, rng: np.random.RandomState) -> int:
+    """Return the position of a maximum of `vals`, breaking ties uniformly at random."""
+    max_positions = np.flatnonzero(vals == vals.max())
+    return max_positions[rng.choice(len(max_positions))]
+
+
+class NodeAccess(ABC):
+    """How the policies of this module reach the progressions of a TreeNode.
+
+    A factored TreeNode holds the progressions relevant to every goal network `gtn`
+    progressed at its state, while an unfactored one holds those of its own goal
+    network only, and is given no `gtn`. Each tree provides its NodeAccess.
+    """
+
+    @abstractmethod
+    def get_goal_network(
+        self, node: TreeNode, gtn: CompiledGoalNetwork | None
+    ) -> CompiledGoalNetwork:
+        """Return the goal network progressed at `node`."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_progressions(self, node: TreeNode, gtn: CompiledGoalNetwork) -> list:
+        """Return the applicable actions and the methods relevant to `gtn`."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_relevant_methods(
+        self, node: TreeNode, gtn: CompiledGoalNetwork
+    ) -> dict[Hashable, tuple]:
+        """Map the methods relevant to `gtn` to the positions they are relevant to."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_ranking(
+        self,
+        node: TreeNode,
+        gtn: CompiledGoalNetwork,
+        key: Hashable,
+        rank: Callable[[], np.ndarray],
+    ) -> np.ndarray:
+        """Return the ranking `key` of the progressions, cached at `node`."""
+        raise NotImplementedError()
+
+
+class TreePolicy[A: Hashable](ABC):
+    """A policy used to select among applicable actions at a TreeNode."""
+
+    @abstractmethod
+    def __call__(
+        self,
+        node: TreeNode,
+        gtn: CompiledGoalNetwork,
+        simulator: PHGNSimulator,
+        rng: np.random.RandomState | None = None,
+    ) -> A:
+        raise NotImplementedError()
+
+
+class ProgressiveWidening[A: Hashable]:
+    """The progressive widening of the progressions considered by a UCBPolicy.
+
+    At a node visited n times, only the first max(1, floor(k * n^alpha)) progressions
+    are considered. They are ranked by the estimates of `heuristic_policy` if given,
+    then by their prior Q values, and ties are broken at random once per node.
+
+    Parameters
+    ----------
+    access : NodeAccess
+        The access to the progressions of the TreeNodes.
+    k : float
+        The number of progressions considered at a node visited once.
+    alpha : float
+        The growth exponent of the number of considered progressions, in (0, 1].
+    heuristic_policy : Optional[HeuristicPolicy]
+        The policy whose estimates rank the progressions first.
+    rng : Optional[np.random.RandomState]
+        The random number generator breaking ties.
+    """
+
+    def __init__(
+        self,
+        access: NodeAccess,
+        k: float,
+        alpha: float = 0.5,
+        heuristic_policy: HeuristicPolicy | None = None,
+        rng: np.random.RandomState | None = None,
+    ) -> None:
+        if k <= 0:
+            raise ValueError(f"widening_k must be positive, got {k}")
+        if not 0 < alpha <= 1:
+            raise ValueError(f"widening_alpha must be in (0, 1], got {alpha}")
+        self.access = access
+        self.k = k
+        self.alpha = alpha
+        self.heuristic_policy = heuristic_policy
+        self.rng = rng or np.random.RandomState()
+
+    def get_width(self, n: float) -> int:
+        """Return the number of progressions considered at a node visited `n` times."""
+        return max(1, int(self.k * n**self.alpha))
+
+    def widen(
+        self,
+        node: TreeNode,
+        gtn: CompiledGoalNetwork,
+        progressions: list[A],
+        columns: np.ndarray,
+        n: float,
+    ) -> tuple[list[A], np.ndarray]:
+        """Return the progressions considered at `node`, and their columns.
+
+        `progressions` are those of `node` at `gtn`, `columns` their columns in the
+        statistics arrays, and `n` the number of visits of `node`.
+        """
+        width = self.get_width(n)
+        if width >= len(progressions):
+            return progressions, columns
+        order = self.access.get_ranking(
+            node, gtn, self, lambda: self._rank(node, gtn, progressions)
+        )[:width]
+        return [progressions[j] for j in order], columns[order]
+
+    def _rank(
+        self, node: TreeNode, gtn: CompiledGoalNetwork, progressions: list[A]
+    ) -> np.ndarray:
+        # the positions of the progressions in the order they are widened
+        keys = [
+            self.rng.random_sample(len(progressions)),
+            -node.get_prior(node.get_columns(progressions)),
+        ]
+        if self.heuristic_policy is not None:
+            keys.append(self.heuristic_policy.get_estimates(node, gtn))
+        return np.lexsort(keys)
+
+
+class DefaultPolicy[A: Hashable](TreePolicy):
+    """A TreePolicy which selects the action at random.
+
+    Subclasses bias the selection, both at TreeNodes and in rollouts, by overriding
+    `_select`. The TreeNodes are reached through `access`.
+    """
+
+    def __init__(
+        self,
+        simulator: PHGNSimulator,
+        access: NodeAccess,
+        rng: np.random.RandomState | None = None,
+    ) -> None:
+        self.simulator: PHGNSimulator = simulator
+        self.access = access
+        self.rng = rng or np.random.RandomState()
+
+    def __call__(self, node: TreeNode, gtn: CompiledGoalNetwork | None = None) -> A:
+        gtn = self.access.get_goal_network(node, gtn)
+        return self._choose(
+            node.state,
+            self.access.get_progressions(node, gtn),
+            self.access.get_relevant_methods(node, gtn),
+            gtn,
+            node,
+        )
+
+    def sample(
+        self,
+        state: Hashable,
+        applicable_actions: set[A],
+        relevant_methods: dict[Hashable, tuple],
+        gtn: CompiledGoalNetwork,
+    ) -> A:
+        """Select one of the actions and relevant methods applicable at `state`.
+
+        `relevant_methods` maps the applicable methods relevant to `gtn` to the
+        positions they are relevant to (see `GoalNetworkCompiler.get_relevant_methods`).
+        Used directly by rollouts, which step states without creating TreeNodes.
+        """
+        progressions = list(applicable_actions) + list(relevant_methods)
+        return self._choose(state, progressions, relevant_methods, gtn)
+
+    def _choose(
+        self,
+        state: Hashable,
+        progressions: list[A],
+        methods: dict[Hashable, tuple],
+        gtn: CompiledGoalNetwork,
+        node: TreeNode | None = None,
+    ) -> A:
+        r = progressions[self._select(state, progressions, gtn, node)]
+        if isinstance(r[0], PHGNMethod):
+            r += tuple(gtn.get_unconstrained_at(methods[r]))
+        return r
+
+    def _select(
+        self,
+        state: Hashable,
+        progressions: list[A],
+        gtn: CompiledGoalNetwork,
+        node: TreeNode | None,
+    ) -> int:
+        # the position of the selected progression; node is None in rollouts
+        return self.rng.choice(len(progressions))
+
+    def _get_ranking(
+        self,
+        progressions: list[A],
+        gtn: CompiledGoalNetwork,
+        node: TreeNode | None,
+        rank: Callable[[], np.ndarray],
+    ) -> np.ndarray:
+        # rankings are computed once per TreeNode, and on every step of a rollout
+        if node is None:
+            return rank()
+        return self.access.get_ranking(node, gtn, self, rank)
+
+
+class HelpfulActionPolicy[A: Hashable](DefaultPolicy[A]):
+    """A DefaultPolicy which prefers helpful progressions.
+
+    An action is helpful if the effects of one of its outcomes assign a fact of an
+    unconstrained subgoal of the goal network (see `RelaxedTask.get_achievers`), and
+    every relevant method is helpful. The policy selects uniformly among the helpful
+    progressions, or among all of them if none is helpful.
+    """
+
+    def __init__(
+        self,
+        simulator: PHGNSimulator,
+        access: NodeAccess,
+        task: RelaxedTask,
+        rng: np.random.RandomState | None = None,
+    ) -> None:
+        super().__init__(simulator, access, rng)
+        self.task = task
+        self._achievers: OrderedDict[tuple[int, ...] | None, set[tuple]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def _select(
+        self,
+        state: Hashable,
+        progressions: list[A],
+        gtn: CompiledGoalNetwork,
+        node: TreeNode | None,
+    ) -> int:
+        helpful = np.flatnonzero(
+            self._get_ranking(
+                progressions, gtn, node, lambda: self._rank(progressions, gtn)
+            )
+        )
+        if not helpful.size:
+            return self.rng.choice(len(progressions))
+        return helpful[self.rng.choice(len(helpful))]
+
+    def _rank(self, progressions: list[A], gtn: CompiledGoalNetwork) -> np.ndarray:
+        # whether each progression is helpful
+        goals = self.task.get_condition_facts(
+            subgoal.get_content() for subgoal in gtn.get_unconstrained()
+        )
+        achievers = self._get_achievers(goals)
+        return np.fromiter(
+            (isinstance(u[0], PHGNMethod) or u in achievers for u in progressions),
+            dtype=bool,
+            count=len(progressions),
+        )
+
+    def _get_achievers(self, goals: tuple[int, ...] | None) -> set[tuple]:
+        # the achievers of the goals, of which only those of the _MAX_ACHIEVER_SETS
+        # most recently used goals are cached
+        achievers = self._achievers.get(goals)
+        if achievers is None:
+            achievers = self.task.get_achievers(goals or ())
+        with self._lock:
+            achievers = self._achievers.setdefault(goals, achievers)
+            self._achievers.move_to_end(goals)
+            if len(self._achievers) > _MAX_ACHIEVER_SETS:
+                self._achievers.popitem(last=False)
+        return achievers
+
+
+class HeuristicPolicy[A: Hashable](DefaultPolicy[A]):
+    """A DefaultPolicy which ranks progressions by the estimates of a Heuristic.
+
+    An action is ranked by the estimated cost of achieving the unconstrained subgoals
+    of the goal network from its relaxed successor, so that ranking neither applies
+    actions nor samples outcomes (see `Heuristic.estimate_successors`), and a method
+    by the estimate at the current state.
+    """
+
+    def __init__(
+        self,
+        simulator: PHGNSimulator,
+        access: NodeAccess,
+        heuristic: Heuristic,
+        rng: np.random.RandomState | None = None,
+    ) -> None:
+        super().__init__(simulator, access, rng)
+        self.heuristic = heuristic
+
+    def get_estimates(
+        self, node: TreeNode, gtn: CompiledGoalNetwork | None = None
+    ) -> np.ndarray:
+        """Return the estimates of the progressions of `node`.
+
+        The estimates are cached at the node, and the returned array must not be
+        modified.
+        """
+        gtn = self.access.get_goal_network(node, gtn)
+        progressions = self.access.get_progressions(node, gtn)
+        return self._get_estimates(node.state, progressions, gtn, node)
+
+    def _get_estimates(
+        self,
+        state: Hashable,
+        progressions: list[A],
+        gtn: CompiledGoalNetwork,
+        node: TreeNode | None,
+    ) -> np.ndarray:
+        return self._get_ranking(
+            progressions, gtn, node, lambda: self._estimate(state, progressions, gtn)
+        )
+
+    def _estimate(
+        self, state: Hashable, progressions: list[A], gtn: CompiledGoalNetwork
+    ) -> np.ndarray:
+        goals = [subgoal.get_content() for subgoal in gtn.get_unconstrained()]
+        is_method = np.fromiter(
+            (isinstance(u[0], PHGNMethod) for u in progressions),
+            dtype=bool,
+            count=len(progressions),
+        )
+        estimates = np.empty(len(progressions))
+        if is_method.any():
+            estimates[is_method] = self.heuristic.estimate(state, goals)
+        actions = [u for u in progressions if not isinstance(u[0], PHGNMethod)]
+        estimates[~is_method] = self.heuristic.estimate_successors(
+            state, actions, goals
+        )
+        return estimates
+
+
+class EpsilonGreedyPolicy[A: Hashable](HeuristicPolicy[A]):
+    """A HeuristicPolicy which selects a progression with the lowest estimate.
+
+    With probability `epsilon`, a progression is selected uniformly at random instead.
+    """
+
+    def __init__(
+        self,
+        simulator: PHGNSimulator,
+        access: NodeAccess,
+        heuristic: Heuristic,
+        epsilon: float = 0.1,
+        rng: np.random.RandomState | None = None,
+    ) -> None:
+        super().__init__(simulator, access, heuristic, rng)
+        self.epsilon = epsilon
+
+    def _select(
+        self,
+        state: Hashable,
+        progressions: list[A],
+        gtn: CompiledGoalNetwork,
+        node: TreeNode | None,
+    ) -> int:
+        if self.rng.random_sample() < self.epsilon:
+            return self.rng.choice(len(progressions))
+        estimates = self._get_estimates(state, progressions, gtn, node)
+        return choose_max(-estimates, self.rng)
+
+
+class BoltzmannPolicy[A: Hashable](HeuristicPolicy[A]):
+    """A HeuristicPolicy which selects progressions with a softmin of their estimates.
+
+    A progression with estimate h is selected with probability proportional to
+    exp(-h / temperature). Progressions from which the subgoals are unreachable are
+    never selected, unless all of them are.
+    """
+
+    def __init__(
+        self,
+        simulator: PHGNSimulator,
+        access: NodeAccess,
+        heuristic: Heuristic,
+        temperature: float = 1.0,
+        rng: np.random.RandomState | None = None,
+    ) -> None:
+        super().__init__(simulator, access, heuristic, rng)
+        self.temperature = temperature
+
+    def _select(
+        self,
+        state: Hashable,
+        progressions: list[A],
+        gtn: CompiledGoalNetwork,
+        node: TreeNode | None,
+    ) -> int:
+        estimates = self._get_estimates(state, progressions, gtn, node)
+        if not (estimates < inf).any():
+            return self.rng.choice(len(progressions))
+        logits = -estimates / self.temperature
+        weights = np.exp(logits - logits.max())
+        return self.rng.choice(len(progressions), p=weights / weights.sum())
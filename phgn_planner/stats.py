@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+
+# The counters of a PlanningStats, which can be incremented concurrently
+COUNTERS = (
+    "rollout_states",
+    "pruned_nodes",
+    "evicted_nodes",
+    "capacity_overruns",
+    "playout_cutoffs",
+)
+
+# The names of the values of PlanningStats.get_summary, in order
+SUMMARY_FIELDS = (
+    "decisions",
+    "min_rollouts_per_decision",
+    "mean_rollouts_per_decision",
+    "max_rollouts_per_decision",
+    "mean_time_per_decision",
+    "max_time_per_decision",
+    "rollouts_saved",
+) + COUNTERS
+
+
+@dataclass
+class PlanningStats:
+    """Statistics collected during a run of a PHGNPlanner.
+
+    Parameters
+    ----------
+    rollouts_per_decision : list[int]
+        number of rollouts performed before each decision
+    time_per_decision : list[float]
+        wall-clock time (in seconds) spent searching before each decision
+    rollouts_saved_per_decision : list[int]
+        number of rollouts skipped by early stopping at each decision
+    rollout_states : int
+        number of states stepped through by rollouts, which are not stored as TreeNodes
+    pruned_nodes : int
+        number of TreeNodes freed because they became unreachable after a decision
+    evicted_nodes : int
+        number of TreeNodes evicted because the node store exceeded its capacity
+    capacity_overruns : int
+        number of rollouts after which the node store still exceeded its capacity,
+        because the nodes which cannot be evicted alone exceed it
+    playout_cutoffs : int
+        number of rollouts stopped at the playout depth and estimated by the heuristics
+    """
+
+    rollouts_per_decision: list[int] = field(default_factory=list)
+    time_per_decision: list[float] = field(default_factory=list)
+    rollouts_saved_per_decision: list[int] = field(default_factory=list)
+    rollout_states: int = 0
+    pruned_nodes: int = 0
+    evicted_nodes: int = 0
+    capacity_overruns: int = 0
+    playout_cutoffs: int = 0
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False, compare=False
+    )
+
+    def record_decision(
+        self, n_rollouts: int, elapsed: float, rollouts_saved: int = 0
+    ) -> None:
+        """Record the number of rollouts and the time spent on one decision."""
+        self.rollouts_per_decision.append(n_rollouts)
+        self.time_per_decision.append(elapsed)
+        self.rollouts_saved_per_decision.append(rollouts_saved)
+
+    def increment(self, counter: str, n: int = 1) -> None:
+        """Add `n` to `counter`, one of `COUNTERS`."""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def get_counters(self) -> dict[str, int]:
+        return {counter: getattr(self, counter) for counter in COUNTERS}
+
+    def add_counters(self, counters: dict[str, int]) -> None:
+        """Add the counts of `counters`, e.g. those collected by a worker process."""
+        for counter, n in counters.items():
+            self.increment(counter, n)
+
+    def num_decisions(self) -> int:
+        return len(self.rollouts_per_decision)
+
+    def get_summary(self) -> dict[str, float | None]:
+        """Return the values of `summary()` by the names of `SUMMARY_FIELDS`.
+
+        The rollout and time statistics are None if no decision was made.
+        """
+        rollouts = self.rollouts_per_decision
+        times = self.time_per_decision
+        summary = {
+            "decisions": len(rollouts),
+            "min_rollouts_per_decision": min(rollouts) if rollouts else None,
+            "mean_rollouts_per_decision": (
+                sum(rollouts) / len(rollouts) if rollouts else None
+            ),
+            "max_rollouts_per_decision": max(rollouts) if rollouts else None,
+            "mean_time_per_decision": sum(times) / len(times) if times else None,
+            "max_time_per_decision": max(times) if times else None,
+            "rollouts_saved": sum(self.rollouts_saved_per_decision),
+        }
+        summary.update(self.get_counters())
+        return summary
+
+    def summary(self) -> str:
+        """Return a one-line, human-readable summary of these statistics."""
+        if not self.rollouts_per_decision:
+            return f"Decisions: 0, Rollout states: {self.rollout_states}"
+        summary = self.get_summary()
+        return (
+            f"Decisions: {summary['decisions']}, "
+            f"Rollouts/decision: min={summary['min_rollouts_per_decision']} "
+            f"mean={summary['mean_rollouts_per_decision']:.1f} "
+            f"max={summary['max_rollouts_per_decision']}, "
+            f"Time/decision: mean={summary['mean_time_per_decision']:.3f}s "
+            f"max={summary['max_time_per_decision']:.3f}s, "
+            f"Rollouts saved: {summary['rollouts_saved']}, "
+            f"Rollout states: {self.rollout_states}, "
+            f"Pruned nodes: {self.pruned_nodes}, "
+            f"Evicted nodes: {self.evicted_nodes}, "
+            f"Capacity overruns: {self.capacity_overruns}, "
+            f"Playout cutoffs: {self.playout_cutoffs}"
+        )
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+import time
+from math import log
 from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, replace
 from enum import Enum, auto
 from typing import Self
@@ -9,18 +12,32 @@ import numpy as np
 from unified_planning.model.action import ProbabilisticAction, InstantaneousAction
 from unified_planning.model.phgn.method import PHGNMethod
 from unified_planning.model.fnode import FNode
-from unified_planning.model.phgn.goal_network import PartialOrderGoalNetwork
 from unified_planning.model.phgn.phgn_problem import PHGNProblem
 from unified_planning.engines.phgn_simulator import PHGNSimulator
 from unified_planning.engines.compilers import PHGNGrounderHelper
 from unified_planning.model.state import UPState
+from phgn_planner.chance import OutcomeEnumerator
 from phgn_planner.config import UCTConfig
-from phgn_planner.unfactored_tree import (
+from phgn_planner.fingerprint import NogoodTable, StateFingerprinter
+from phgn_planner.heuristics import HEURISTICS, GoalCountHeuristic, RelaxedTask
+from phgn_planner.goal_network import CompiledGoalNetwork, GoalNetworkCompiler
+from phgn_planner.parallel import run_root_parallel, split_rollouts
+from phgn_planner.policies import (
+    ROLLOUT_POLICIES,
+    BoltzmannPolicy,
     DefaultPolicy,
+    EpsilonGreedyPolicy,
+    HelpfulActionPolicy,
+    HeuristicPolicy,
+)
+from phgn_planner.stats import PlanningStats
+from phgn_planner.unfactored_tree import (
     MaxPolicy,
     TreeNode,
+    TreeNodeAccess,
     TreeNodeFactory,
     UCBPolicy,
+    release_satisfied,
 )
 
 
@@ -29,12 +46,12 @@ class PlanningResult(Enum):
 
     SUCCESS         -> Successfully reached the goal
     DEADLOCKED      -> Reached a deadlocking state
-    EXCEEDED_BUDGET -> Unable to reach goal within cost budget
+    EXCEEDED_BUDGET -> Unable to reach goal within cost or time budget
     """
 
     SUCCESS = auto()  # Successfully reached the goal
     FAILURE_DEADLOCKED = auto()  # Reached a deadlocking state
-    FAILURE_BUDGET = auto()  # Unable to reach goal within cost budget
+    FAILURE_BUDGET = auto()  # Unable to reach goal within cost or time budget
 
     def __repr__(self):
         cls_name = self.__class__.__name__
@@ -46,10 +63,25 @@ class PlanningContext:
     problem: PHGNProblem
     simulator: PHGNSimulator
     grounder: PHGNGrounderHelper
+    compiler: GoalNetworkCompiler
+    fingerprints: StateFingerprinter
+    dead_ends: NogoodTable
     initial_state: UPState
-    initial_gtn: PartialOrderGoalNetwork
+    initial_gtn: CompiledGoalNetwork
     node_factory: TreeNodeFactory
     n_rollouts: int
+    n_workers: int
+    n_threads: int
+    virtual_loss: int
+    time_per_decision: float | None
+    time_budget: float | None
+    start_time: float
+    early_stop_interval: int | None
+    early_stop_confidence: float
+    prune_tree: bool
+    chance_nodes: bool
+    outcomes: OutcomeEnumerator
+    expectation_backup: bool
     horizon: int
     budget: float
     exploration_const: float
@@ -62,22 +94,29 @@ class PlanningContext:
     h_ptg: Callable[[UPState], float]
     q_init: Callable[[UPState, InstantaneousAction | ProbabilisticAction], float]
     n_init: float
+    playout_depth: int | None
+    evaluate_leaf: Callable[[UPState, int], tuple[float, float]]
     default_policy: DefaultPolicy
     ucb_policy: UCBPolicy
     max_policy: MaxPolicy
     rng: np.random.RandomState
+    stats: PlanningStats
 
 
 class RolloutResult:
-    """The result of a LAMP rollout."""
+    """The result of a LAMP rollout.
+
+    `has_goal` is 1 if the rollout achieved the goal network and 0 otherwise, or the
+    estimated probability of achieving it if the rollout was cut off.
+    """
 
     costs: dict[FNode, float] = {}
     has_goal: dict[FNode, bool] = {}
 
     def __init__(
         self,
-        cost: int = 0,
-        has_goal: bool = False,
+        cost: float = 0,
+        has_goal: bool | float = False,
     ):
         self.cost = cost
         self.has_goal = has_goal
@@ -105,21 +144,80 @@ class PHGNPlanner:
             default values will be used.
         """
         self.cfg = cfg or UCTConfig()
+        self.stats: PlanningStats | None = None
 
     def _setup(self, problem: PHGNProblem, cfg: UCTConfig) -> PlanningContext:
         """Setup the PlanningContext for a run of this PHGNPlanner."""
         rng = np.random.RandomState(seed=cfg.seed)
         simulator = PHGNSimulator(problem=problem, rng=rng)
+        grounder = PHGNGrounderHelper(problem)
+        compiler = GoalNetworkCompiler[FNode](grounder)
+        fingerprints = StateFingerprinter[UPState, FNode](
+            problem.initial_values, cfg.seed
+        )
+
+        h_util = cfg.h_util or (lambda _: 1)
+        h_ptg = cfg.h_ptg or (lambda _: 1)
+        leaf_util, leaf_ptg = h_util, h_ptg
+        if cfg.playout_depth is not None and (cfg.h_util is None or cfg.h_ptg is None):
+            # a constant estimate would make every cut-off rollout look successful
+            goal_count = GoalCountHeuristic[UPState](
+                problem, RelaxedTask(problem, grounder), fingerprints=fingerprints
+            )
+            leaf_util = cfg.h_util or goal_count.utility(cfg.risk_factor)
+            leaf_ptg = cfg.h_ptg or goal_count.goal_probability()
+
+        def q_init(state: UPState, u: tuple) -> float:
+            # the prior Q value of a progression, from the state it leads to
+            return h_util(state) + h_ptg(state) * cfg.goal_utility
+
+        def evaluate_leaf(state: UPState, steps_left: int) -> tuple[float, float]:
+            # the remaining cost whose utility is h_util(state), and the probability of
+            # achieving the remaining subgoals; a state of utility 0 cannot achieve
+            # them, and is charged the steps left like a dead end
+            utility = leaf_util(state)
+            if utility <= 0:
+                return steps_left, 0.0
+            if cfg.risk_factor == 0:
+                return 0, leaf_ptg(state)
+            return log(utility) / cfg.risk_factor, leaf_ptg(state)
+
+        default_policy = self._make_default_policy(
+            problem, grounder, simulator, rng, cfg, fingerprints
+        )
         ctx = PlanningContext(
             problem=problem,
             simulator=simulator,
-            grounder=PHGNGrounderHelper(problem),
+            grounder=grounder,
+            compiler=compiler,
+            fingerprints=fingerprints,
+            dead_ends=NogoodTable[UPState](),
             initial_state=simulator.get_initial_state(),
-            initial_gtn=problem.goal_network.copy(),
+            initial_gtn=compiler.compile(problem.goal_network),
             node_factory=TreeNodeFactory[
                 UPState, InstantaneousAction | ProbabilisticAction, PHGNMethod, FNode
-            ](simulator),
+            ](
+                simulator,
+                compiler,
+                cfg.max_nodes,
+                cfg.eviction_policy,
+                fingerprints,
+                q_init,
+                cfg.n_init,
+            ),
             n_rollouts=cfg.n_rollouts,
+            n_workers=cfg.n_workers,
+            n_threads=cfg.n_threads,
+            virtual_loss=cfg.virtual_loss if cfg.n_threads > 1 else 0,
+            time_per_decision=cfg.time_per_decision,
+            time_budget=cfg.time_budget,
+            start_time=time.perf_counter(),
+            early_stop_interval=cfg.early_stop_interval,
+            early_stop_confidence=cfg.early_stop_confidence,
+            prune_tree=cfg.prune_tree,
+            chance_nodes=cfg.chance_nodes,
+            outcomes=OutcomeEnumerator[UPState](problem, grounder),
+            expectation_backup=cfg.expectation_backup,
             horizon=cfg.horizon,
             budget=cfg.budget,
             exploration_const=cfg.exploration_const,
@@ -130,19 +228,67 @@ class PHGNPlanner:
             if isinstance(u[0], (InstantaneousAction, ProbabilisticAction))
             else 0,  # 0 if check_goal(s, g) else 1
             utility_fn=lambda cost: np.exp(cfg.risk_factor * cost),
-            h_util=cfg.h_util,
-            h_ptg=cfg.h_ptg,
-            q_init=lambda s, a: cfg.h_util(s) + cfg.h_ptg(s) * cfg.goal_utility,
+            h_util=h_util,
+            h_ptg=h_ptg,
+            q_init=q_init,
             n_init=cfg.n_init,
-            default_policy=DefaultPolicy(simulator, rng),
+            playout_depth=cfg.playout_depth,
+            evaluate_leaf=evaluate_leaf,
+            default_policy=default_policy,
             ucb_policy=UCBPolicy(
-                simulator, rng, cfg.exploration_const, cfg.normalize_exploration_const
+                simulator,
+                rng,
+                cfg.exploration_const,
+                cfg.normalize_exploration_const,
+                cfg.widening_k,
+                cfg.widening_alpha,
+                default_policy if isinstance(default_policy, HeuristicPolicy) else None,
             ),
             max_policy=MaxPolicy(simulator, rng),
             rng=rng,
+            stats=PlanningStats(),
         )
         return ctx
 
+    def _make_default_policy(
+        self,
+        problem: PHGNProblem,
+        grounder: PHGNGrounderHelper,
+        simulator: PHGNSimulator,
+        rng: np.random.RandomState,
+        cfg: UCTConfig,
+        fingerprints: StateFingerprinter[UPState, FNode],
+    ) -> DefaultPolicy:
+        """Return the rollout policy selected by `cfg.rollout_policy`.
+
+        Its heuristic, if any, shares the `fingerprints` of the planner.
+        """
+        if cfg.rollout_policy not in ROLLOUT_POLICIES:
+            raise ValueError(
+                f"Unknown rollout policy '{cfg.rollout_policy}', "
+                f"expected one of {ROLLOUT_POLICIES}"
+            )
+        if cfg.rollout_policy == "random":
+            return DefaultPolicy(simulator, TreeNodeAccess(), rng)
+        task = RelaxedTask(problem, grounder)
+        if cfg.rollout_policy == "helpful":
+            return HelpfulActionPolicy(simulator, TreeNodeAccess(), task, rng)
+        if cfg.rollout_heuristic not in HEURISTICS:
+            raise ValueError(
+                f"Unknown rollout heuristic '{cfg.rollout_heuristic}', "
+                f"expected one of {tuple(HEURISTICS)}"
+            )
+        heuristic = HEURISTICS[cfg.rollout_heuristic](
+            problem, task, fingerprints=fingerprints
+        )
+        if cfg.rollout_policy == "epsilon_greedy":
+            return EpsilonGreedyPolicy(
+                simulator, TreeNodeAccess(), heuristic, cfg.rollout_epsilon, rng
+            )
+        return BoltzmannPolicy(
+            simulator, TreeNodeAccess(), heuristic, cfg.rollout_temperature, rng
+        )
+
     def run(
         self,
         problem: PHGNProblem,
@@ -155,7 +301,7 @@ class PHGNPlanner:
         problem : Problem
             The problem to run the planner on.
 
-        gtn : PartialOrderGoalNetwork
+        gtn : CompiledGoalNetwork
             The initial goal-task network for the HGN planning problem.
 
         **override_config : Any
@@ -164,11 +310,12 @@ class PHGNPlanner:
         """
         cfg = replace(self.cfg, **override_config)
         ctx = self._setup(problem, cfg)
+        self.stats = ctx.stats
 
         node: TreeNode = ctx.node_factory.new_node(ctx.initial_state, ctx.initial_gtn)
         cumulative_cost = 0
         while True:
-            if cumulative_cost >= ctx.budget:
+            if cumulative_cost >= ctx.budget or self._out_of_time(ctx):
                 return (
                     PlanningResult.FAILURE_BUDGET,
                     cumulative_cost,
@@ -186,17 +333,23 @@ class PHGNPlanner:
                     cumulative_cost,
                     ctx.node_factory.num_nodes(),
                 )
+            # the executed network only grows with decompositions otherwise
+            node.gtn.compact()
             action_or_method = self._plan(ctx, node, cumulative_cost)
             if isinstance(action_or_method[0], PHGNMethod):
-                node = ctx.node_factory.new_node(
+                node = ctx.node_factory.new_child(
+                    node,
                     node.state,
                     node.gtn.copy().decompose(
-                        ctx.grounder.ground_method(
+                        ctx.compiler.compile_method(
                             action_or_method[0], action_or_method[1]
-                        ).goal_network,
+                        ),
                         action_or_method[2],
                     ),
                 )
+                if ctx.prune_tree:
+                    pruned = ctx.node_factory.prune(node, ctx.horizon)
+                    ctx.stats.increment("pruned_nodes", pruned)
                 if cfg.show_progress:
                     print(
                         f"\rSelected method {action_or_method[0].name, action_or_method[1]}",
@@ -204,9 +357,12 @@ class PHGNPlanner:
                     )
             else:
                 action_cost = ctx.cost_fn(node.state, action_or_method)
-                node = ctx.node_factory.new_node(
-                    ctx.simulator.apply(node.state, *action_or_method), node.gtn.copy()
+                node = ctx.node_factory.new_child(
+                    node, node.get_successor(action_or_method), node.gtn.copy()
                 )
+                if ctx.prune_tree:
+                    pruned = ctx.node_factory.prune(node, ctx.horizon)
+                    ctx.stats.increment("pruned_nodes", pruned)
                 cumulative_cost += action_cost
                 if cfg.show_progress:
                     print(
@@ -220,10 +376,199 @@ class PHGNPlanner:
         """Perform iterations of PHGN UCT, then return the best action or method."""
         if node.gtn.is_empty():
             return
-        for _ in range(ctx.n_rollouts):
-            self._simulate(ctx, node, 0, cumulative_cost)
+        start = time.perf_counter()
+        deadline = self._get_deadline(ctx, start, cumulative_cost)
+        # in anytime mode, search until the deadline rather than for a fixed n_rollouts
+        n_rollouts = ctx.n_rollouts if deadline is None else None
+        if ctx.n_workers > 1:
+            rollouts = self._search_root_parallel(
+                ctx, node, cumulative_cost, n_rollouts, deadline
+            )
+        else:
+            rollouts = self._search(ctx, node, cumulative_cost, n_rollouts, deadline)
+        ctx.stats.record_decision(
+            rollouts,
+            time.perf_counter() - start,
+            n_rollouts - rollouts if n_rollouts is not None else 0,
+        )
         return node.select(ctx.max_policy)
 
+    def _search(
+        self,
+        ctx: PlanningContext,
+        node: TreeNode,
+        cumulative_cost: int,
+        n_rollouts: int | None,
+        deadline: float | None = None,
+    ) -> int:
+        """Perform `n_rollouts` iterations of PHGN UCT from `node`.
+
+        If `n_rollouts` is None, iterations are performed until `deadline` (a
+        `time.perf_counter()` value). With `ctx.n_threads > 1` the iterations are shared
+        between threads which descend the same tree concurrently (tree-parallel UCT).
+        Returns the number of iterations performed.
+        """
+        if ctx.n_threads > 1:
+            with ThreadPoolExecutor(max_workers=ctx.n_threads) as pool:
+                futures = [
+                    pool.submit(
+                        self._run_rollouts, ctx, node, cumulative_cost, n, deadline
+                    )
+                    for n in split_rollouts(n_rollouts, ctx.n_threads)
+                ]
+            return sum(future.result() for future in futures)
+        return self._run_rollouts(ctx, node, cumulative_cost, n_rollouts, deadline)
+
+    def _run_rollouts(
+        self,
+        ctx: PlanningContext,
+        node: TreeNode,
+        cumulative_cost: int,
+        n_rollouts: int | None,
+        deadline: float | None = None,
+    ) -> int:
+        """Perform `n_rollouts` iterations of PHGN UCT from `node` in this thread.
+
+        If `n_rollouts` is None, iterations are performed until `deadline`, but there is
+        always at least one. With `ctx.early_stop_interval`, the search stops early once
+        the best progression at `node` is decided (see `_is_decided`), which is checked
+        every `ctx.early_stop_interval` iterations, so that statistics kept from earlier
+        decisions are not enough to stop before any iteration. Returns the number of
+        iterations performed.
+        """
+        i = 0
+        while (n_rollouts is None or i < n_rollouts) and (
+            deadline is None or i == 0 or time.perf_counter() < deadline
+        ):
+            if (
+                ctx.early_stop_interval
+                and i
+                and i % ctx.early_stop_interval == 0
+                and self._is_decided(ctx, node)
+            ):
+                break
+            self._simulate(ctx, node, 0, cumulative_cost)
+            i += 1
+            evicted = ctx.node_factory.enforce_capacity(node)
+            if evicted:
+                ctx.stats.increment("evicted_nodes", evicted)
+            if ctx.node_factory.is_over_capacity():
+                ctx.stats.increment("capacity_overruns")
+        return i
+
+    def _is_decided(self, ctx: PlanningContext, node: TreeNode) -> bool:
+        """Whether more rollouts are unlikely to change the best progression at `node`.
+
+        This is the case if there is only one progression, or if the lower confidence
+        bound of the progression with the highest Q value beats the upper confidence
+        bounds of all other progressions.
+        """
+        progressions = node.get_progressions()
+        if len(progressions) <= 1:
+            return True
+        columns = node.get_columns(progressions)
+        q = node.Q[columns]
+        radius = self._confidence_radius(ctx, node.N[columns])
+        best = int(np.argmax(q))
+        upper = np.delete(q + radius, best)
+        return bool(np.all(q[best] - radius[best] > upper))
+
+    def _confidence_radius(self, ctx: PlanningContext, n: np.ndarray) -> np.ndarray:
+        """Hoeffding radii of Q values estimated from `n` rollouts each.
+
+        Rollout returns lie in [0, 1 + goal utility] for non-positive risk factors.
+        """
+        delta = 1 - ctx.early_stop_confidence
+        with np.errstate(divide="ignore"):
+            return (1 + ctx.goal_utility) * np.sqrt(log(2 / delta) / (2 * n))
+
+    def _get_deadline(
+        self, ctx: PlanningContext, start: float, cumulative_cost: int
+    ) -> float | None:
+        """Return the time by which a decision started at `start` must be made.
+
+        Times are `time.perf_counter()` values. Returns None if planning is not
+        time-limited.
+
+        Without `ctx.time_per_decision`, the remaining `ctx.time_budget` is shared
+        evenly between the decisions which the remaining cost budget allows.
+        """
+        timeouts = []
+        if ctx.time_per_decision is not None:
+            timeouts.append(ctx.time_per_decision)
+        if ctx.time_budget is not None:
+            remaining = ctx.time_budget - (start - ctx.start_time)
+            if ctx.time_per_decision is None:
+                remaining /= max(1, ctx.budget - cumulative_cost)
+            timeouts.append(remaining)
+        if not timeouts:
+            return None
+        return start + min(timeouts)
+
+    def _out_of_time(self, ctx: PlanningContext) -> bool:
+        """Whether the overall time budget of this run has been used up."""
+        return (
+            ctx.time_budget is not None
+            and time.perf_counter() - ctx.start_time >= ctx.time_budget
+        )
+
+    def _search_root_parallel(
+        self,
+        ctx: PlanningContext,
+        node: TreeNode,
+        cumulative_cost: int,
+        n_rollouts: int | None,
+        deadline: float | None = None,
+    ) -> int:
+        """Split the rollouts across `ctx.n_workers` processes and merge their root statistics.
+
+        Each worker is forked from the current tree, reseeds the shared RNG with its own
+        seed and performs its share of the rollouts. Only the root statistics of each
+        worker are sent back and merged into `node`, as in root parallelization: the
+        subtrees the workers grew below `node` are discarded, since the decision at
+        `node` only depends on its statistics. Returns the total number of iterations
+        performed.
+        """
+        # the progressions the serial search considers at the root
+        progressions = node.get_progressions()
+
+        def task(seed: int, n_rollouts: int | None):
+            ctx.rng.seed(seed)
+            counters = ctx.stats.get_counters()
+            rollouts = self._search(ctx, node, cumulative_cost, n_rollouts, deadline)
+            return (
+                node.get_statistics(progressions),
+                rollouts,
+                {
+                    counter: n - counters[counter]
+                    for counter, n in ctx.stats.get_counters().items()
+                },
+            )
+
+        prior = node.get_statistics(progressions)
+        seeds = ctx.rng.randint(2**31 - 1, size=ctx.n_workers).tolist()
+        results = run_root_parallel(
+            task, seeds, split_rollouts(n_rollouts, ctx.n_workers)
+        )
+        node.merge_statistics(progressions, prior, [r[0] for r in results])
+        for r in results:
+            ctx.stats.add_counters(r[2])
+        return sum(r[1] for r in results)
+
+    def _step(
+        self, ctx: PlanningContext, node: TreeNode, action: tuple
+    ) -> tuple[UPState, int | None]:
+        """Apply `action` at `node`, returning the next state and the outcome index.
+
+        With `ctx.chance_nodes`, the outcome of a ProbabilisticAction is sampled from
+        its ChanceNode at `node`. Otherwise, the outcome index is None.
+        """
+        if ctx.chance_nodes and isinstance(action[0], ProbabilisticAction):
+            chance_node = node.get_chance_node(action, ctx.outcomes)
+            outcome = chance_node.sample(ctx.rng)
+            return chance_node.states[outcome], outcome
+        return node.get_successor(action), None
+
     def _simulate(
         self,
         ctx: PlanningContext,
@@ -231,84 +576,150 @@ class PHGNPlanner:
         depth: int,
         cumulative_cost: int,
     ) -> RolloutResult:
-        """Perform one rollout of PHGN UCT and backpropagate costs."""
-        # Base Cases
-        if node.gtn.is_empty():
-            return RolloutResult(0, True)
-        if node.is_deadend():
-            future_cost = ctx.horizon - 1 - depth
-            return RolloutResult(future_cost, False)
-        if depth == ctx.horizon - 1:
-            return RolloutResult(1, False)
-        # The unconstrained subgoal has not yet been achieved. Select an action/method to execute.
-        if not node.is_expanded():
-            node.expand()
-            u = node.select(ctx.default_policy)
-            if isinstance(u[0], (InstantaneousAction, ProbabilisticAction)):
-                next_node = ctx.node_factory.new_node(
-                    ctx.simulator.apply(node.state, *u), node.gtn.copy()
+        """Perform one rollout of PHGN UCT and backpropagate costs.
+
+        The descent records the path of (node, progression, cumulative cost, outcome)
+        steps it takes, which is then walked backwards in a single loop. The nodes it
+        descends to are pinned until then, so that they are not evicted by other
+        threads.
+        """
+        path = []
+        pinned = []
+        while True:
+            # Base Cases
+            if node.gtn.is_empty():
+                result = RolloutResult(0, True)
+                break
+            dead_end = ctx.dead_ends.contains(node.fingerprint, node.state)
+            if dead_end or node.is_deadend():
+                ctx.dead_ends.add(node.fingerprint, node.state)
+                future_cost = ctx.horizon - 1 - depth
+                result = RolloutResult(future_cost, False)
+                break
+            if depth == ctx.horizon - 1:
+                result = RolloutResult(1, False)
+                break
+            # The unconstrained subgoal has not yet been achieved. Select an action/method to execute.
+            if not node.is_expanded():
+                node.expand()
+                u = node.select(ctx.default_policy)
+                if ctx.virtual_loss:
+                    node.add_virtual_loss(u[:2], ctx.virtual_loss)
+                outcome = None
+                if isinstance(u[0], (InstantaneousAction, ProbabilisticAction)):
+                    next_state, outcome = self._step(ctx, node, u)
+                    ctx.stats.increment("rollout_states")
+                    next_gtn = node.gtn.copy()
+                else:  # u is a Method
+                    next_state = node.state
+                    next_gtn = node.gtn.copy().decompose(
+                        ctx.compiler.compile_method(u[0], u[1]), u[2]
+                    )
+                path.append((node, u, cumulative_cost, outcome))
+                fingerprint = ctx.fingerprints.update(
+                    node.fingerprint, node.state, next_state
                 )
-            else:  # u is a Method
-                new_gtn = node.gtn.copy()
-                next_node = ctx.node_factory.new_node(
-                    node.state,
-                    new_gtn.decompose(
-                        ctx.grounder.ground_method(u[0], u[1]).goal_network, u[2]
-                    ),
+                result = self._rollout(
+                    ctx, next_state, next_gtn, depth + 1, fingerprint
                 )
-            result = self._rollout(ctx, next_node, depth + 1)
-        else:
+                break
             u = node.select(ctx.ucb_policy)
+            if ctx.virtual_loss:
+                node.add_virtual_loss(u[:2], ctx.virtual_loss)
+            outcome = None
             if isinstance(u[0], (InstantaneousAction, ProbabilisticAction)):
-                next_node = ctx.node_factory.new_node(
-                    ctx.simulator.apply(node.state, *u), node.gtn.copy()
+                next_state, outcome = self._step(ctx, node, u)
+                next_node = ctx.node_factory.new_child(
+                    node, next_state, node.gtn.copy(), pin=True
                 )
                 cumulative_cost += 1
             else:  # u is a Method
                 new_gtn = node.gtn.copy()
-                next_node = ctx.node_factory.new_node(
+                next_node = ctx.node_factory.new_child(
+                    node,
                     node.state,
                     new_gtn.decompose(
-                        ctx.grounder.ground_method(u[0], u[1]).goal_network, u[2]
+                        ctx.compiler.compile_method(u[0], u[1]), u[2]
                     ),
+                    pin=True,
                 )
-            result = self._simulate(ctx, next_node, depth + 1, cumulative_cost)
-        u_cost = ctx.cost_fn(node.state, u)
-        node.update(
-            u[:2], result, cumulative_cost + u_cost, ctx.goal_utility, ctx.utility_fn
-        )
-        return result.increment(u_cost)
+            path.append((node, u, cumulative_cost, outcome))
+            pinned.append(next_node)
+            node.add_child(next_node)
+            node = next_node
+            depth += 1
+        for node, u, cumulative_cost, outcome in reversed(path):
+            u_cost = ctx.cost_fn(node.state, u)
+            node.update(
+                u[:2],
+                result,
+                cumulative_cost + u_cost,
+                ctx.goal_utility,
+                ctx.utility_fn,
+                ctx.virtual_loss,
+                outcome if ctx.expectation_backup else None,
+            )
+            result.increment(u_cost)
+        ctx.node_factory.unpin(pinned)
+        return result
 
     def _rollout(
         self,
         ctx: PlanningContext,
-        node: TreeNode,
+        state: UPState,
+        gtn: CompiledGoalNetwork,
         depth: int,
+        fingerprint: int,
     ) -> RolloutResult:
-        """Perform one rollout of LAMP and backpropagate costs."""
-        # Base Cases
-        if node.gtn.is_empty():
-            return RolloutResult(0, True)
-        if node.is_deadend():
-            future_cost = ctx.horizon - 1 - depth
-            return RolloutResult(future_cost, False)
-        if depth == ctx.horizon - 1:
-            return RolloutResult(0, False)
-        # The unconstrained subgoal has not yet been achieved. Select an action/method to execute.
-        node.expand()
-        u = node.select(ctx.default_policy)
-        if isinstance(u[0], (InstantaneousAction, ProbabilisticAction)):
-            next_node = ctx.node_factory.new_node(
-                ctx.simulator.apply(node.state, *u), node.gtn.copy()
-            )
-        else:  # u is a Method
-            new_gtn = node.gtn.copy()
-            next_node = ctx.node_factory.new_node(
-                node.state,
-                new_gtn.decompose(
-                    ctx.grounder.ground_method(u[0], u[1]).goal_network, u[2]
+        """Perform one rollout of LAMP and backpropagate costs.
+
+        Rollouts only step the simulator state and `gtn`, which is modified in place; no
+        TreeNodes are created. Costs are accumulated on the way down. With
+        `ctx.playout_depth`, the rollout is cut off after that many steps and the rest
+        of it is estimated by `ctx.evaluate_leaf`.
+        """
+        cost = 0
+        cutoff = None if ctx.playout_depth is None else depth + ctx.playout_depth
+        while True:
+            release_satisfied(ctx.simulator, state, gtn)
+            # Base Cases
+            if gtn.is_empty():
+                result = RolloutResult(0, True)
+                break
+            if ctx.dead_ends.contains(fingerprint, state):
+                actions = set()
+            else:
+                actions = set(ctx.simulator.get_applicable_actions(state))
+                if not actions:
+                    ctx.dead_ends.add(fingerprint, state)
+            if not actions:
+                future_cost = ctx.horizon - 1 - depth
+                result = RolloutResult(future_cost, False)
+                break
+            if depth == cutoff:
+                steps_left = ctx.horizon - 1 - depth
+                result = RolloutResult(*ctx.evaluate_leaf(state, steps_left))
+                ctx.stats.increment("playout_cutoffs")
+                break
+            if depth == ctx.horizon - 1:
+                result = RolloutResult(0, False)
+                break
+            # The unconstrained subgoal has not yet been achieved. Select an action/method to execute.
+            u = ctx.default_policy.sample(
+                state,
+                actions,
+                ctx.compiler.get_relevant_methods(
+                    ctx.simulator.get_applicable_methods(state), gtn
                 ),
+                gtn,
             )
-        result = self._rollout(ctx, next_node, depth + 1)
-        u_cost = ctx.cost_fn(node.state, u)
-        return result.increment(u_cost)
+            cost += ctx.cost_fn(state, u)
+            if isinstance(u[0], (InstantaneousAction, ProbabilisticAction)):
+                next_state = ctx.simulator.apply(state, *u)
+                fingerprint = ctx.fingerprints.update(fingerprint, state, next_state)
+                state = next_state
+                ctx.stats.increment("rollout_states")
+            else:  # u is a Method
+                gtn.decompose(ctx.compiler.compile_method(u[0], u[1]), u[2])
+            depth += 1
+        return result.increment(cost)
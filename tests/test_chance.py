@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("unified_planning.model")
+
+from unified_planning.model import Fluent, Problem
+from unified_planning.model.effect import Effect, EffectKind
+from unified_planning.model.state import UPState
+from unified_planning.shortcuts import FALSE, TRUE, BoolType, Int, IntType
+
+from phgn_planner.chance import ChanceNode, OutcomeEnumerator, _alias_table
+
+
+@pytest.mark.parametrize(
+    "probabilities",
+    [[1.0], [0.5, 0.5], [0.9, 0.1], [0.1, 0.2, 0.3, 0.4], [0.7, 0.0, 0.2, 0.1]],
+)
+def test_alias_table(probabilities: list[float]) -> None:
+    probabilities = np.array(probabilities)
+    n = len(probabilities)
+    prob, alias = _alias_table(probabilities)
+    # outcome i is drawn when its column is kept, or when it is the alias of another
+    drawn = np.array(prob) / n
+    for j, i in enumerate(alias):
+        drawn[i] += (1 - prob[j]) / n
+    assert drawn == pytest.approx(probabilities)
+
+
+def test_sample() -> None:
+    chance_node = ChanceNode[str]([(0.6, "a"), (0.3, "b"), (0.1, "c")])
+    rng = np.random.RandomState(0)
+    counts = np.bincount([chance_node.sample(rng) for _ in range(20000)], minlength=3)
+    assert counts / counts.sum() == pytest.approx([0.6, 0.3, 0.1], abs=0.02)
+
+
+def test_sample_normalizes_probabilities() -> None:
+    chance_node = ChanceNode[str]([(2, "a"), (0, "b")])
+    rng = np.random.RandomState(0)
+    assert chance_node.probabilities == pytest.approx([1, 0])
+    assert {chance_node.sample(rng) for _ in range(100)} == {0}
+
+
+def test_backup_expectation() -> None:
+    chance_node = ChanceNode[str]([(0.75, "a"), (0.25, "b")])
+    rows = np.array([0, 2])
+    no_prior = np.zeros(2)
+    q = chance_node.backup(0, rows, np.array([1.0, 0.0]), no_prior, no_prior)
+    # only the backed-up outcome counts until the other one is backed up
+    assert q == pytest.approx([1.0, 0.0])
+    q = chance_node.backup(1, rows, np.array([0.0, 1.0]), no_prior + 1, q)
+    assert q == pytest.approx([0.75, 0.25])
+    q = chance_node.backup(1, rows[:1], np.array([1.0]), no_prior[:1] + 2, q[:1])
+    assert q == pytest.approx([0.75 + 0.25 * 0.5])
+
+
+def test_backup_blends_prior() -> None:
+    chance_node = ChanceNode[str]([(0.5, "a"), (0.5, "b")])
+    rows = np.array([0])
+    q = chance_node.backup(0, rows, np.array([1.0]), np.array([5.0]), np.array([0.5]))
+    assert q == pytest.approx([(5 * 0.5 + 1.0) / 6])
+    q = chance_node.backup(1, rows, np.array([0.0]), np.array([6.0]), q)
+    assert q == pytest.approx([(5 * 0.5 + 2 * 0.5) / 7])
+
+
+def test_outcome_enumerator() -> None:
+    problem = Problem("robot")
+    on = [Fluent(f"on_{i}", BoolType()) for i in range(4)]
+    for fluent in on:
+        problem.add_fluent(fluent, default_initial_value=False)
+    problem.add_fluent(Fluent("fuel", IntType(0, 10)), default_initial_value=3)
+    on_0, on_1, on_2, on_3 = (problem.fluent(f"on_{i}")() for i in range(4))
+    fuel = problem.fluent("fuel")()
+    problem.set_initial_value(on_0, True)
+    problem.set_initial_value(on_3, True)
+    success = [
+        Effect(on_1, TRUE(), TRUE()),
+        Effect(fuel, Int(1), TRUE(), EffectKind.DECREASE),
+        Effect(on_2, TRUE(), on_0),
+        Effect(on_0, FALSE(), on_1),
+        # a deleted and added boolean fluent ends up added
+        Effect(on_3, TRUE(), TRUE()),
+        Effect(on_3, FALSE(), TRUE()),
+    ]
+    ground_action = SimpleNamespace(
+        outcomes={"success": 0.9, "failure": 0.1},
+        effects={"success": success, "failure": []},
+    )
+    grounder = SimpleNamespace(ground_action=lambda action, params: ground_action)
+    state = UPState(problem.explicit_initial_values, problem)
+    outcomes = OutcomeEnumerator[UPState](problem, grounder).get_outcomes(
+        state, "move", ()
+    )
+    assert [p for p, _ in outcomes] == pytest.approx([0.9, 0.1])
+    succeeded, failed = (s for _, s in outcomes)
+    assert failed == state
+    assert succeeded.get_value(on_1) == TRUE()
+    assert succeeded.get_value(on_2) == TRUE()
+    assert succeeded.get_value(on_3) == TRUE()
+    assert succeeded.get_value(fuel) == Int(2)
+    # effects are evaluated in the original state
+    assert succeeded.get_value(on_0) == TRUE()
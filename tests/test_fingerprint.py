@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+pytest.importorskip("unified_planning.model")
+
+from unified_planning.model import Fluent, Problem
+from unified_planning.model.state import UPState
+from unified_planning.shortcuts import FALSE, TRUE, BoolType
+
+from phgn_planner.fingerprint import NogoodTable, StateFingerprinter
+
+
+@pytest.fixture
+def problem() -> Problem:
+    problem = Problem("lights")
+    for i in range(8):
+        light = Fluent(f"on_{i}", BoolType())
+        problem.add_fluent(light, default_initial_value=False)
+    problem.set_initial_value(problem.fluent("on_0")(), True)
+    return problem
+
+
+def make_children(problem: Problem, length: int, seed: int = 0) -> list[UPState]:
+    """A chain of `length` successors of the initial state, made by `make_child`."""
+    rng = random.Random(seed)
+    fluents = list(problem.initial_values)
+    states = [UPState(problem.explicit_initial_values, problem)]
+    for _ in range(length):
+        changed = rng.sample(fluents, rng.randint(1, 3))
+        states.append(
+            states[-1].make_child({f: rng.choice([TRUE(), FALSE()]) for f in changed})
+        )
+    return states
+
+
+def test_update_matches_fingerprint(problem: Problem) -> None:
+    fingerprinter = StateFingerprinter(problem.initial_values, seed=0)
+    states = make_children(problem, 3 * UPState.MAX_ANCESTORS)
+    # make_child flattens the chain once it has MAX_ANCESTORS ancestors
+    assert any(state._father is None for state in states[1:])
+    fingerprint = fingerprinter.fingerprint(states[0])
+    for state, next_state in zip(states, states[1:]):
+        fingerprint = fingerprinter.update(fingerprint, state, next_state)
+        assert fingerprint == fingerprinter.fingerprint(next_state)
+
+
+def test_update_after_condensing(problem: Problem) -> None:
+    fingerprinter = StateFingerprinter(problem.initial_values, seed=0)
+    states = make_children(problem, 10)
+    fingerprints = [fingerprinter.fingerprint(state) for state in states]
+    # hashing a UPState condenses its ancestors in place
+    hash(states[5])
+    hash(states[8])
+    for i in range(len(states) - 1):
+        assert (
+            fingerprinter.update(fingerprints[i], states[i], states[i + 1])
+            == fingerprints[i + 1]
+        )
+
+
+def test_update_of_unrelated_state(problem: Problem) -> None:
+    fingerprinter = StateFingerprinter(problem.initial_values, seed=0)
+    first = make_children(problem, 5, seed=1)
+    second = make_children(problem, 5, seed=2)
+    fingerprint = fingerprinter.fingerprint(first[-1])
+    assert fingerprinter.update(fingerprint, first[-1], first[-1]) == fingerprint
+    assert fingerprinter.update(
+        fingerprint, first[-1], second[-1]
+    ) == fingerprinter.fingerprint(second[-1])
+
+
+def test_equal_states_have_equal_fingerprints(problem: Problem) -> None:
+    fingerprinter = StateFingerprinter(problem.initial_values, seed=0)
+    initial = UPState(problem.explicit_initial_values, problem)
+    on_1 = problem.fluent("on_1")()
+    child = initial.make_child({on_1: TRUE()}).make_child({on_1: FALSE()})
+    assert child == initial
+    assert fingerprinter.fingerprint(child) == fingerprinter.fingerprint(initial)
+
+
+def test_nogood_table(problem: Problem) -> None:
+    fingerprinter = StateFingerprinter(problem.initial_values, seed=0)
+    initial = UPState(problem.explicit_initial_values, problem)
+    child = initial.make_child({problem.fluent("on_1")(): TRUE()})
+    table = NogoodTable[UPState]()
+    table.add(fingerprinter.fingerprint(child), child)
+    assert len(table) == 1
+    assert table.contains(fingerprinter.fingerprint(child), child)
+    assert not table.contains(fingerprinter.fingerprint(initial), initial)
+    # a different state with a taken fingerprint is not a dead end
+    assert not table.contains(fingerprinter.fingerprint(child), initial)
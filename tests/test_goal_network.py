@@ -0,0 +1,40 @@
+import pytest
+
+# goal networks are compiled from PHGN problems, which need the fork of
+# unified_planning
+pytest.importorskip("unified_planning.model.phgn.goal_network")
+
+from phgn_planner.goal_network import CompiledGoalNetwork, GoalInterner, GoalNode
+
+
+def chain(goal_ids: list[int], signatures: GoalInterner[tuple]) -> CompiledGoalNetwork:
+    """A network ordering the subgoals `goal_ids` one after the other."""
+    n = len(goal_ids)
+    return CompiledGoalNetwork[str](
+        [GoalNode(i, goal_id, f"g{goal_id}") for i, goal_id in enumerate(goal_ids)],
+        [0 if i == 0 else 1 << (i - 1) for i in range(n)],
+        [0 if i == n - 1 else 1 << (i + 1) for i in range(n)],
+        signatures,
+    )
+
+
+def test_equal_networks() -> None:
+    signatures = GoalInterner[tuple]()
+    first, second = chain([0, 1], signatures), chain([0, 1], signatures)
+    assert first == second and hash(first) == hash(second)
+    assert first != chain([1, 0], signatures)
+    released = chain([2, 0, 1], signatures)
+    released.release(released.get_unconstrained()[0])
+    assert released == first
+
+
+def test_keys_are_recomputed_after_reset() -> None:
+    signatures = GoalInterner[tuple]()
+    first, second = chain([0], signatures), chain([1], signatures)
+    copy = first.copy()
+    hash(first)
+    signatures.clear()
+    # the key of second reuses the signature IDs of the key of first
+    hash(second)
+    assert first != second and copy != second
+    assert first == copy == chain([0], signatures)
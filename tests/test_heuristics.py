@@ -0,0 +1,162 @@
+from math import inf
+
+import pytest
+
+# the heuristics relax PHGN problems, which need the fork of unified_planning
+pytest.importorskip("unified_planning.model.phgn.phgn_problem")
+
+from unified_planning.model.action import InstantaneousAction, ProbabilisticAction
+from unified_planning.model.phgn.phgn_problem import PHGNProblem
+from unified_planning.model.state import UPState
+from unified_planning.shortcuts import FALSE, TRUE, BoolType, UserType
+
+from phgn_planner.fingerprint import StateFingerprinter
+from phgn_planner.heuristics import (
+    HEURISTICS,
+    FFHeuristic,
+    GoalCountHeuristic,
+    RelaxedTask,
+)
+
+
+@pytest.fixture(scope="module")
+def problem() -> PHGNProblem:
+    """A truck on a line of 4 locations, which must carry a package from l2 to l3."""
+    problem = PHGNProblem()
+    Location = UserType("Location")
+    road = problem.add_fluent(
+        "road", BoolType(), default_initial_value=False, x=Location, y=Location
+    )
+    truck_at = problem.add_fluent(
+        "truck_at", BoolType(), default_initial_value=False, x=Location
+    )
+    package_at = problem.add_fluent(
+        "package_at", BoolType(), default_initial_value=False, x=Location
+    )
+    loaded = problem.add_fluent("loaded", BoolType(), default_initial_value=False)
+    locations = [problem.add_object(f"l{i}", Location) for i in range(4)]
+    for x, y in zip(locations, locations[1:]):
+        problem.set_initial_value(road(x, y), True)
+        problem.set_initial_value(road(y, x), True)
+    problem.set_initial_value(truck_at(locations[0]), True)
+    problem.set_initial_value(package_at(locations[2]), True)
+
+    drive = InstantaneousAction("drive", x=Location, y=Location)
+    drive.add_precondition(truck_at(drive.x))
+    drive.add_precondition(road(drive.x, drive.y))
+    drive.add_effect(truck_at(drive.x), False)
+    drive.add_effect(truck_at(drive.y), True)
+    problem.add_action(drive)
+
+    pick = InstantaneousAction("pick", x=Location)
+    pick.add_precondition(truck_at(pick.x))
+    pick.add_precondition(package_at(pick.x))
+    pick.add_effect(package_at(pick.x), False)
+    pick.add_effect(loaded, True)
+    problem.add_action(pick)
+
+    drop = ProbabilisticAction("drop", x=Location)
+    drop.add_precondition(truck_at(drop.x))
+    drop.add_precondition(loaded)
+    drop.add_outcome("success", 0.5)
+    drop.add_effect("success", package_at(drop.x), True)
+    drop.add_effect("success", loaded, False)
+    drop.add_outcome("failure", 0.5)
+    problem.add_action(drop)
+    return problem
+
+
+@pytest.fixture(scope="module")
+def task(problem: PHGNProblem) -> RelaxedTask:
+    return RelaxedTask(problem)
+
+
+def fluent(problem: PHGNProblem, name: str, *args: str):
+    return problem.fluent(name)(*(problem.object(arg) for arg in args))
+
+
+def initial_state(problem: PHGNProblem) -> UPState:
+    return UPState(problem.initial_values, problem)
+
+
+def make_child(
+    problem: PHGNProblem, state: UPState, true: tuple, false: tuple
+) -> UPState:
+    """The child of `state` where the fluents `true` hold and `false` do not."""
+    values = {fluent(problem, *f): TRUE() for f in true}
+    values.update({fluent(problem, *f): FALSE() for f in false})
+    return state.make_child(values)
+
+
+def test_estimates(problem: PHGNProblem, task: RelaxedTask) -> None:
+    goals = [fluent(problem, "package_at", "l3")]
+    state = initial_state(problem)
+    estimates = {
+        name: heuristic(problem, task, goals)(state)
+        for name, heuristic in HEURISTICS.items()
+    }
+    # drive to l2, pick the package up, drive to l3 and drop it
+    assert estimates == {"goal_count": 1, "hmax": 4, "hadd": 7, "ff": 5}
+
+
+def test_estimates_after_progress(problem: PHGNProblem, task: RelaxedTask) -> None:
+    goals = [fluent(problem, "package_at", "l3")]
+    state = initial_state(problem)
+    for x, y in [("l0", "l1"), ("l1", "l2")]:
+        state = make_child(problem, state, [("truck_at", y)], [("truck_at", x)])
+    state = make_child(problem, state, [("loaded",)], [("package_at", "l2")])
+    heuristic = FFHeuristic(problem, task, goals)
+    assert heuristic(state) == 2
+    assert heuristic.estimate(state, [fluent(problem, "truck_at", "l0")]) == 2
+
+
+def test_unreachable_goals(problem: PHGNProblem, task: RelaxedTask) -> None:
+    # no action adds a road
+    goals = [fluent(problem, "road", "l0", "l3")]
+    state = initial_state(problem)
+    for name, heuristic in HEURISTICS.items():
+        h = heuristic(problem, task, goals)
+        if heuristic is GoalCountHeuristic:
+            assert h(state) == 1
+        else:
+            assert h(state) == inf, name
+            assert h.utility()(state) == 0
+            assert h.goal_probability()(state) == 0
+
+
+def test_satisfied_goals(problem: PHGNProblem, task: RelaxedTask) -> None:
+    goals = [fluent(problem, "package_at", "l2")]
+    state = initial_state(problem)
+    for heuristic in HEURISTICS.values():
+        h = heuristic(problem, task, goals)
+        assert h(state) == 0
+        assert h.utility()(state) == 1
+        assert h.goal_probability()(state) == 1
+
+
+def test_shared_fingerprints(problem: PHGNProblem, task: RelaxedTask) -> None:
+    fingerprints = StateFingerprinter(problem.initial_values, seed=0)
+    goals = [fluent(problem, "package_at", "l3")]
+    heuristic = FFHeuristic(problem, task, goals, fingerprints=fingerprints)
+    state = initial_state(problem)
+    child = make_child(problem, state, [("truck_at", "l1")], [("truck_at", "l0")])
+    assert heuristic.fingerprint(state) == fingerprints.fingerprint(state)
+    # the fingerprint of a child of a recently evaluated state is updated
+    assert heuristic.fingerprint(child) == fingerprints.fingerprint(child)
+
+
+def test_estimate_successors(problem: PHGNProblem, task: RelaxedTask) -> None:
+    goals = [fluent(problem, "package_at", "l3")]
+    state = initial_state(problem)
+    ground_actions = {
+        (action.name, *map(str, params)): (action, params)
+        for action, params in task.labels
+    }
+    labels = [ground_actions["drive", "l0", "l1"], ground_actions["pick", "l2"]]
+    heuristic = FFHeuristic(problem, task, goals)
+    # driving towards the package saves an action, picking it up is not applicable
+    assert heuristic.estimate_successors(state, labels, goals) == [4, 5]
+    # the estimates are memoized, and picking up explores nothing new
+    assert len(heuristic._successor_memo) == 2
+    assert heuristic.estimate_successors(state, labels, goals) == [4, 5]
+    assert heuristic.estimate_successors(state, labels, [FALSE()]) == [inf, inf]
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+import pytest
+
+# the planners simulate PHGN problems, which need the fork of unified_planning
+pytest.importorskip("unified_planning.engines.phgn_simulator")
+
+from phgn_planner import factored_uct, unfactored_uct
+from phgn_planner.config import UCTConfig
+
+
+class CopyableNetwork:
+    def copy(self) -> "CopyableNetwork":
+        return self
+
+
+@pytest.mark.parametrize("module", [factored_uct, unfactored_uct])
+@pytest.mark.parametrize("interval", [1, 5])
+def test_early_stop_waits_for_new_rollouts(module, interval: int) -> None:
+    planner = module.PHGNPlanner(UCTConfig())
+    checked_after = []
+    simulated = []
+    # the root statistics kept from the previous decision are already decided
+    planner._is_decided = lambda *args: checked_after.append(len(simulated)) or True
+    planner._simulate = lambda *args: simulated.append(args)
+    ctx = SimpleNamespace(
+        early_stop_interval=interval,
+        undo_goal_network=False,
+        node_factory=SimpleNamespace(
+            enforce_capacity=lambda node: 0, is_over_capacity=lambda: False
+        ),
+        stats=None,
+    )
+    if module is factored_uct:
+        rollouts = planner._run_rollouts(ctx, None, CopyableNetwork(), 0, 100)
+    else:
+        rollouts = planner._run_rollouts(ctx, None, 0, 100)
+    assert rollouts == interval
+    assert checked_after == [interval]
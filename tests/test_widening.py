@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+# the policies select methods of PHGN problems, which need the fork of
+# unified_planning
+pytest.importorskip("unified_planning.model.phgn")
+
+from phgn_planner.policies import NodeAccess, ProgressiveWidening
+
+
+class CachingAccess(NodeAccess):
+    """A NodeAccess which caches every ranking once, as TreeNodes do."""
+
+    def __init__(self) -> None:
+        self.rankings = {}
+
+    def get_goal_network(self, node, gtn):
+        return gtn
+
+    def get_progressions(self, node, gtn):
+        return node.progressions
+
+    def get_relevant_methods(self, node, gtn):
+        return {}
+
+    def get_ranking(self, node, gtn, key, rank):
+        if key not in self.rankings:
+            self.rankings[key] = rank()
+        return self.rankings[key]
+
+
+def make_node(prior: list[float]) -> SimpleNamespace:
+    """A node whose progressions have the `prior` Q values, in this order."""
+    return SimpleNamespace(
+        get_columns=lambda progressions: np.arange(len(progressions)),
+        get_prior=lambda columns: np.asarray(prior)[columns],
+    )
+
+
+def widen(widening: ProgressiveWidening, node: SimpleNamespace, n: float) -> list:
+    progressions = list("abcd")
+    widened, columns = widening.widen(node, None, progressions, np.arange(4), n)
+    assert [progressions[j] for j in columns] == widened
+    return widened
+
+
+@pytest.mark.parametrize(
+    "k, alpha, n, width",
+    [(1, 0.5, 0, 1), (1, 0.5, 4, 2), (2, 0.5, 9, 6), (1.5, 1, 3, 4), (0.5, 0.5, 1, 1)],
+)
+def test_width(k: float, alpha: float, n: float, width: int) -> None:
+    assert ProgressiveWidening(CachingAccess(), k, alpha).get_width(n) == width
+
+
+def test_width_grows() -> None:
+    widening = ProgressiveWidening(CachingAccess(), 1, 0.5)
+    widths = [widening.get_width(n) for n in range(100)]
+    assert widths == sorted(widths)
+    assert widths[-1] == 9
+
+
+@pytest.mark.parametrize("k, alpha", [(0, 0.5), (-1, 0.5), (1, 0), (1, 1.5)])
+def test_invalid_parameters(k: float, alpha: float) -> None:
+    with pytest.raises(ValueError):
+        ProgressiveWidening(CachingAccess(), k, alpha)
+
+
+def test_widen_by_prior() -> None:
+    widening = ProgressiveWidening(CachingAccess(), 1, 0.5)
+    node = make_node([0.1, 0.9, 0.5, 0.3])
+    assert widen(widening, node, 0) == ["b"]
+    assert widen(widening, node, 4) == ["b", "c"]
+    assert widen(widening, node, 16) == ["a", "b", "c", "d"]
+
+
+def test_widen_by_estimates() -> None:
+    estimates = np.array([2.0, 3.0, 1.0, 2.0])
+    heuristic_policy = SimpleNamespace(get_estimates=lambda node, gtn: estimates)
+    widening = ProgressiveWidening(CachingAccess(), 1, 0.5, heuristic_policy)
+    # the lowest estimate first, then the highest prior among equal estimates
+    node = make_node([0.1, 0.9, 0.5, 0.3])
+    assert widen(widening, node, 4) == ["c", "d"]
+    assert widen(widening, node, 9) == ["c", "d", "a"]
+
+
+def test_ties_are_broken_once() -> None:
+    rng = np.random.RandomState(0)
+    widening = ProgressiveWidening(CachingAccess(), 1, 0.5, rng=rng)
+    node = make_node([0.0] * 4)
+    first = widen(widening, node, 1)
+    # widening only adds progressions to the ones already considered
+    assert widen(widening, node, 1) == first
+    assert widen(widening, node, 4)[:1] == first
+    assert widen(widening, node, 9)[:2] == widen(widening, node, 4)